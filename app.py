@@ -1,17 +1,127 @@
-from flask import Flask, request, send_file, render_template
+from flask import Flask, request, send_file, render_template, jsonify, abort
 from generar_factura import (
-    generar_factura_A,
-    generar_factura_B,
+    estimar_memoria_factura,
+    estimar_memoria_reporte,
+    generar_artefactos,
+    generar_reporte,
+    layout_spec,
 )
+import historial
+from coalescencia import Coalescedor, clave_pedido
+from limites import Limitador, MemoriaStore, Rechazo, SQLiteStore
+from memoria import ControlMemoria
+from perfilado import Perfilador
+from tiendas import cargar_tiendas, resolver_tienda
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
+import hashlib
+import hmac
+import io
 import re
 import os
-from typing import List, Tuple
+import tempfile
+from typing import Dict, List, Optional, Tuple
 
 # from flask_cors import CORS  # si sirves HTML desde otro dominio
 app = Flask(__name__, static_folder="static", template_folder="templates")
 # CORS(app)
 
+# Peticiones idénticas simultáneas (doble clic, reintentos) comparten un solo render.
+# Con los workers sync de gunicorn cada proceso atiende una petición a la vez, así
+# que la coordinación entre workers (un directorio local compartido) viene activada
+# por defecto; FACTURAS_COALESCER_DIR cambia el directorio y "0" la desactiva.
+_coalescer_dir = os.environ.get(
+    "FACTURAS_COALESCER_DIR", os.path.join(tempfile.gettempdir(), "facturas-coalescer")
+)
+coalescedor = Coalescedor(directorio=None if _coalescer_dir in ("", "0") else _coalescer_dir)
+
+# PDFs deterministas: mismos datos, mismos bytes (ETag estable, caché y deduplicación).
+PDF_DETERMINISTA = os.environ.get("FACTURAS_PDF_DETERMINISTA", "1") != "0"
+
+# Miniaturas PNG generadas junto con cada PDF, para compartir por WhatsApp.
+# FACTURAS_MINIATURAS=0 las desactiva; el formulario puede pedir miniatura=0.
+MINIATURAS_ACTIVAS = os.environ.get("FACTURAS_MINIATURAS", "1") != "0"
+MAX_MINIATURAS = 128
+# Se guardan en disco (FACTURAS_MINIATURAS_DIR) para que el enlace X-Miniatura funcione
+# aunque el GET llegue a otro worker. Un subdirectorio por tienda, cada uno con su
+# propio tope, para que una tienda no desplace a otra. Con varios dynos el directorio
+# debe ser compartido; el predeterminado solo lo comparten los workers de un dyno.
+MINIATURAS_DIR = os.environ.get("FACTURAS_MINIATURAS_DIR") or os.path.join(
+    tempfile.gettempdir(), "facturas-miniaturas"
+)
+CLAVE_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+# Perfilado bajo demanda: con FACTURAS_PERFIL_SECRETO, la cabecera X-Perfil (o ?perfil=)
+# con ese valor perfila la petición; FACTURAS_PERFIL_MUESTREO=N perfila 1 de cada N.
+perfilador = Perfilador(
+    secreto=os.environ.get("FACTURAS_PERFIL_SECRETO"),
+    directorio=os.environ.get("FACTURAS_PERFIL_DIR", "/tmp/perfiles"),
+    muestreo=int(os.environ.get("FACTURAS_PERFIL_MUESTREO", "0") or 0),
+    max_archivos=int(os.environ.get("FACTURAS_PERFIL_MAX_ARCHIVOS", "50")),
+    max_bytes=int(os.environ.get("FACTURAS_PERFIL_MAX_MB", "50")) * 1024 * 1024,
+)
+
+# El reporte de cierre expone ventas y clientes: solo responde con la cabecera
+# X-Reporte (o ?clave=) igual a FACTURAS_REPORTE_SECRETO; sin secreto no existe.
+REPORTE_SECRETO = os.environ.get("FACTURAS_REPORTE_SECRETO")
+
+# Detrás del router de Heroku u otro proxy, FACTURAS_PROXIES indica cuántos saltos
+# confiar en X-Forwarded-For para que remote_addr sea la IP real del cliente.
+# En Heroku (DYNO definido) se confía por defecto en el salto del router; sin eso
+# todos los clientes compartirían la cubeta de la IP del router.
+_proxies = int(os.environ.get("FACTURAS_PROXIES", "1" if os.environ.get("DYNO") else "0") or 0)
+if _proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=_proxies)
+
+if os.environ.get("DYNO") and not os.environ.get("FACTURAS_DB"):
+    print(
+        "[historial] FACTURAS_DB no está definido: el disco del dyno es efímero y no se comparte;"
+        " el historial y la numeración se pierden en cada reinicio.",
+        flush=True,
+    )
+
+# Admisión: cubeta de tokens por IP y tope de renders simultáneos.
+# FACTURAS_LIMITES_DB comparte los contadores entre workers mediante SQLite; un slot
+# sin renovar vence a los FACTURAS_SLOT_TTL segundos (el reporte lo renueva por bloque).
+_limites_db = os.environ.get("FACTURAS_LIMITES_DB")
+_ttl_slot = float(os.environ.get("FACTURAS_SLOT_TTL", "60") or 60)
+limitador = Limitador(
+    store=SQLiteStore(_limites_db, ttl_slot=_ttl_slot) if _limites_db else MemoriaStore(),
+    tasa=float(os.environ.get("FACTURAS_LIMITE_TASA", "1")),
+    rafaga=int(os.environ.get("FACTURAS_LIMITE_RAFAGA", "5")),
+    max_renders=int(os.environ.get("FACTURAS_MAX_RENDERS", "2")),
+)
+
+# Techo de memoria por render (FACTURAS_MEMORIA_MAX_MB, 0 lo desactiva): los trabajos
+# cuya estimación lo supera se rechazan con 413 antes de empezar. Con
+# FACTURAS_MEMORIA_MUESTREO=N se mide con tracemalloc el pico de 1 de cada N renders.
+# Con los topes del parser (MAX_LARGO_MENSAJE) el comprobante más grande se estima
+# en unos 5.5 MB, así que el valor predeterminado nunca rechaza un comprobante: es
+# una salvaguarda para reportes cuyos bloques traen muchísimos productos y para el
+# caso de que se amplíen esos topes. Para imponerlo de verdad, bájalo (por ejemplo a 8).
+_memoria_max_mb = float(os.environ.get("FACTURAS_MEMORIA_MAX_MB", "64") or 0)
+memoria = ControlMemoria(
+    techo=int(_memoria_max_mb * 1024 * 1024) or None,
+    muestreo=int(os.environ.get("FACTURAS_MEMORIA_MUESTREO", "0") or 0),
+)
+
+# Tiendas (FACTURAS_TIENDAS apunta a un JSON); sin archivo hay una sola tienda
+# con las plantillas A y B. Cada tienda tiene su cubeta por IP y su cuota de
+# renders dentro del tope global de 'limitador'.
+TIENDAS = cargar_tiendas(os.environ.get("FACTURAS_TIENDAS"))
+limitadores_tienda = {
+    slug: Limitador(
+        store=limitador.store,
+        tasa=tienda["limite_tasa"] or limitador.tasa,
+        rafaga=tienda["limite_rafaga"] or limitador.rafaga,
+        max_renders=tienda["max_renders"] or limitador.max_renders,
+        espacio=f"tienda:{slug}",
+    )
+    for slug, tienda in TIENDAS.items()
+}
+# Especificación del comprobante por tienda para el render sin conexión del navegador.
+LAYOUTS = {slug: layout_spec(tienda["plantillas"]) for slug, tienda in TIENDAS.items()}
+
 CANTIDAD_MAP = {
     "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
     "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
@@ -34,18 +144,53 @@ HEADER_PATTERNS = {
     "fecha": re.compile(r"^fecha\s*[:\-]?\s*(?P<valor>.+)$", re.IGNORECASE),
 }
 
+# El lookbehind evita reintentar la búsqueda desde cada dígito de un mismo número,
+# que con cadenas largas de dígitos o separadores volvía cuadrático el análisis.
 PRICE_PATTERN = re.compile(
-    r"(?P<precio>[\$qQ]?\s*\d+(?:[.,]\d+)?)(?:\s*(?:c/u|cada\s+uno|unidad|u)?)\s*$",
+    r"(?<![\d.,])(?P<precio>[\$qQ]?\s*\d+(?:[.,]\d+)?)(?:\s*(?:c/u|cada\s+uno|unidad|u)?)\s*$",
     re.IGNORECASE,
 )
 
 CONNECTORES_TOTALES = {"a", "x", "por", "precio", "cada", "c/u"}
 MAX_TOKENS_CANTIDAD = 4
+# Límites de entrada: se validan antes de aplicar expresiones regulares para que
+# el costo del análisis quede acotado sin importar lo que envíe el usuario.
+MAX_LARGO_MENSAJE = 20000
+MAX_LARGO_LINEA = 300
+# Identificador que el navegador asigna a un pedido hecho sin conexión.
+ID_LOCAL_PATTERN = re.compile(r"[A-Za-z0-9-]{8,64}")
+
+
+def _tienda_actual(slug=None):
+    tienda = resolver_tienda(TIENDAS, request.host, slug)
+    if tienda is None:
+        abort(404)
+    return tienda
 
 
 @app.route("/")
-def home():
-    return render_template("index.html")
+@app.route("/t/<tienda>/")
+def home(tienda=None):
+    _tienda_actual(tienda)
+    return render_template("index.html", base=f"/t/{tienda}" if tienda else "")
+
+
+@app.route("/layout.json", methods=["GET"])
+@app.route("/t/<tienda>/layout.json", methods=["GET"])
+def layout(tienda=None):
+    """Posiciones, fuentes y plantillas del comprobante para dibujarlo en el navegador."""
+    respuesta = jsonify(LAYOUTS[_tienda_actual(tienda)["slug"]])
+    respuesta.add_etag()
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+
+@app.route("/sw.js", methods=["GET"])
+def service_worker():
+    # Se sirve desde la raíz para que su alcance cubra "/" y "/t/<tienda>/".
+    respuesta = send_file(os.path.join(app.static_folder, "sw.js"), mimetype="text/javascript")
+    respuesta.cache_control.no_cache = True
+    return respuesta
 
 def _safe_nombre_cliente(nombre: str) -> str:
     """
@@ -61,46 +206,36 @@ def _safe_nombre_cliente(nombre: str) -> str:
     nombre = re.sub(r'[\\/:*?"<>|]+', "", nombre)
     return nombre or "Cliente"
 
-@app.route("/generar_desde_texto", methods=["POST"])
-def generar_desde_texto():
-    plantilla = (request.form.get("plantilla") or "A").upper()
-    mensaje = request.form.get("mensaje")
-    cliente_form = (request.form.get("cliente") or "").strip()
-    estado_form = (request.form.get("estado") or "").strip()
-    fecha_form = (request.form.get("fecha") or "").strip()
-    productos_texto = request.form.get("productos")
-    monto_parcial_raw = request.form.get("monto_parcial")
+def _respuesta_rechazo(rechazo: Rechazo):
+    if rechazo.retry_after is None:
+        return f"❌ {rechazo}", rechazo.status
+    return f"❌ {rechazo}", rechazo.status, {"Retry-After": str(rechazo.retry_after)}
 
-    modo_formulario = any([cliente_form, estado_form, fecha_form, productos_texto])
 
+@app.route("/generar_desde_texto", methods=["POST"])
+@app.route("/t/<tienda>/generar_desde_texto", methods=["POST"])
+@perfilador.perfilable
+def generar_desde_texto(tienda=None):
+    tienda = _tienda_actual(tienda)
     try:
-        if modo_formulario:
-            cliente = cliente_form
-            estado = estado_form
-            fecha = fecha_form or "HOY"
-            productos = parsear_productos(productos_texto)
-
-            if not cliente:
-                raise ValidacionError("Ingresa el nombre del cliente.")
-            if not estado:
-                raise ValidacionError("Selecciona un estado para el pedido.")
-            if not fecha:
-                raise ValidacionError("Selecciona una fecha válida.")
+        limitadores_tienda[tienda["slug"]].admitir(request.remote_addr or "desconocido")
+    except Rechazo as e:
+        return _respuesta_rechazo(e)
 
-            fecha_valida = procesar_fecha(fecha)
-            productos.sort(key=lambda x: x[1].lower())
-            total_factura = sum(p[3] for p in productos)
-            if total_factura <= 0:
-                raise ValidacionError("El total calculado es 0. Revisa los productos ingresados.")
+    plantilla = _plantilla_pedido(tienda)
+    mensaje = request.form.get("mensaje")
+    modo_formulario = any(
+        (request.form.get(campo) or "").strip() for campo in ("cliente", "estado", "fecha")
+    ) or bool(request.form.get("productos"))
 
-            pago_parcial = _interpretar_pago_parcial(estado, monto_parcial_raw)
-            if pago_parcial and pago_parcial > total_factura:
-                raise ValidacionError("El pago parcial no puede ser mayor al total calculado.")
+    try:
+        if modo_formulario:
+            cliente, estado, fecha_valida, productos, pago_parcial = _datos_formulario(tienda)
         else:
             if not mensaje:
                 return "❌ No se recibió el texto", 400
 
-            cliente, estado, fecha, productos = parsear_mensaje(mensaje)
+            cliente, estado, fecha, productos = parsear_mensaje(mensaje, catalogo=tienda["catalogo"])
 
             if not cliente:
                 raise ValidacionError("Falta el nombre del cliente (línea 'CLIENTE ...').")
@@ -120,29 +255,314 @@ def generar_desde_texto():
 
             pago_parcial = 0.0
 
-        if plantilla == "B":
-            pdf_stream = generar_factura_B(
-                cliente,
-                estado,
-                fecha_valida,
-                productos,
-                pago_parcial=pago_parcial,
-            )
-        else:
-            pdf_stream = generar_factura_A(
+        miniatura = MINIATURAS_ACTIVAS and request.form.get("miniatura") != "0"
+        memoria.admitir(
+            estimar_memoria_factura(len(productos), miniatura=miniatura),
+            "El pedido tiene demasiados productos para un solo comprobante.",
+        )
+        # El navegador asigna un id_local a cada venta y lo repite al reemitir su
+        # comprobante o al encolarla si esta petición no responde a tiempo; así el
+        # historial actualiza la venta en lugar de contarla otra vez.
+        id_local = (request.form.get("id_local") or "").strip() or None
+        if id_local is not None and not ID_LOCAL_PATTERN.fullmatch(id_local):
+            raise ValidacionError("El identificador local del pedido no es válido.")
+        # La tienda y la venta forman parte de la clave: dos ventas con los mismos
+        # datos, o en tiendas distintas, no comparten render ni registro.
+        clave = clave_pedido(
+            tienda["slug"], id_local, plantilla, cliente, estado, fecha_valida, productos, pago_parcial, miniatura
+        )
+        pdf_bytes = coalescedor.ejecutar(
+            clave,
+            lambda: _renderizar_pdf(
+                tienda, clave, id_local, plantilla, cliente, estado, fecha_valida, productos, pago_parcial, miniatura
+            ),
+        )
+
+        # === Nombre de salida: [CLIENTE]_Comprobante[FECHA].pdf ===
+        cliente_safe = _safe_nombre_cliente(cliente)
+        fecha_filename = fecha_valida.replace("/", "-")  # dd-mm-YYYY
+        filename = f"{cliente_safe}_Comprobante{fecha_filename}.pdf"
+
+        respuesta = send_file(
+            io.BytesIO(pdf_bytes),
+            mimetype="application/pdf",
+            as_attachment=True,
+            download_name=filename,
+        )
+        if PDF_DETERMINISTA:
+            respuesta.set_etag(hashlib.sha256(pdf_bytes).hexdigest())
+        if miniatura and _obtener_miniatura(tienda["slug"], clave) is not None:
+            respuesta.headers["X-Miniatura"] = f"/t/{tienda['slug']}/miniatura/{clave}"
+        return respuesta
+    except ValidacionError as e:
+        return f"❌ {e}", 422
+    except Rechazo as e:
+        return _respuesta_rechazo(e)
+    except Exception as e:
+        print("Error /generar_desde_texto:", e, flush=True)
+        return f"❌ Error al procesar el mensaje: {e}", 500
+
+
+def _plantilla_pedido(tienda) -> str:
+    plantilla = (request.form.get("plantilla") or "A").upper()
+    if plantilla not in tienda["plantillas"]:
+        plantilla = next(iter(tienda["plantillas"]))
+    return plantilla
+
+
+def _datos_formulario(tienda):
+    """Valida los campos del formulario guiado; devuelve (cliente, estado, fecha, productos, pago_parcial)."""
+    cliente = (request.form.get("cliente") or "").strip()
+    estado = (request.form.get("estado") or "").strip()
+    fecha = (request.form.get("fecha") or "").strip() or "HOY"
+    productos = parsear_productos(request.form.get("productos"), catalogo=tienda["catalogo"])
+
+    if not cliente:
+        raise ValidacionError("Ingresa el nombre del cliente.")
+    if not estado:
+        raise ValidacionError("Selecciona un estado para el pedido.")
+
+    fecha_valida = procesar_fecha(fecha)
+    productos.sort(key=lambda x: x[1].lower())
+    total_factura = sum(p[3] for p in productos)
+    if total_factura <= 0:
+        raise ValidacionError("El total calculado es 0. Revisa los productos ingresados.")
+
+    pago_parcial = _interpretar_pago_parcial(estado, request.form.get("monto_parcial"))
+    if pago_parcial and pago_parcial > total_factura:
+        raise ValidacionError("El pago parcial no puede ser mayor al total calculado.")
+    return cliente, estado, fecha_valida, productos, pago_parcial
+
+
+@app.route("/pedidos", methods=["POST"])
+@app.route("/t/<tienda>/pedidos", methods=["POST"])
+def sincronizar_pedido(tienda=None):
+    """
+    Registra un pedido cuyo comprobante ya se generó en el navegador sin conexión.
+    No se renderiza nada; si la venta con ese 'id_local' ya está registrada se
+    actualiza, así los reintentos de la cola no la duplican.
+    """
+    tienda = _tienda_actual(tienda)
+    id_local = (request.form.get("id_local") or "").strip()
+    try:
+        limitadores_tienda[tienda["slug"]].admitir(request.remote_addr or "desconocido")
+        if not ID_LOCAL_PATTERN.fullmatch(id_local):
+            raise ValidacionError("Falta el identificador local del pedido.")
+        cliente, estado, fecha_valida, productos, pago_parcial = _datos_formulario(tienda)
+        plantilla = _plantilla_pedido(tienda)
+        numero = historial.registrar(
+            cliente,
+            estado,
+            fecha_valida,
+            productos,
+            plantilla=plantilla,
+            pago_parcial=pago_parcial,
+            tienda=tienda["slug"],
+            id_local=id_local,
+        )
+    except ValidacionError as e:
+        return f"❌ {e}", 422
+    except Rechazo as e:
+        return _respuesta_rechazo(e)
+    except Exception as e:
+        print("Error /pedidos:", e, flush=True)
+        return f"❌ Error al registrar el pedido: {e}", 500
+    return jsonify({"id_local": id_local, "numero": numero})
+
+
+def _renderizar_pdf(tienda, clave, id_local, plantilla, cliente, estado, fecha_valida, productos,
+                    pago_parcial, miniatura) -> bytes:
+    """
+    Reserva el número del comprobante y genera el PDF (y su miniatura); solo lo
+    ejecuta la petición líder. Si el render falla, la reserva se descarta para
+    que el pedido no cuente en los reportes; una venta ya registrada solo se
+    actualiza con los datos nuevos después de generar su comprobante.
+    """
+    with limitador.slot_render(), limitadores_tienda[tienda["slug"]].slot_render():
+        nuevo = False
+        try:
+            numero, nuevo = historial.reservar(
                 cliente,
                 estado,
                 fecha_valida,
                 productos,
+                plantilla=plantilla,
                 pago_parcial=pago_parcial,
+                tienda=tienda["slug"],
+                id_local=id_local,
             )
+        except Exception as exc:
+            # Sin correlativo el comprobante se genera igual; no se bloquea la descarga.
+            print("Error al registrar comprobante:", exc, flush=True)
+            numero = None
+
+        estimado = estimar_memoria_factura(len(productos), miniatura=miniatura)
+        try:
+            with memoria.medir("comprobante", estimado):
+                artefactos = generar_artefactos(
+                    cliente,
+                    estado,
+                    fecha_valida,
+                    productos,
+                    tema=tienda["plantillas"][plantilla],
+                    pago_parcial=pago_parcial,
+                    miniatura=miniatura,
+                    deterministico=PDF_DETERMINISTA,
+                    numero=numero,
+                )
+        except BaseException:
+            if nuevo:
+                try:
+                    historial.descartar(numero, tienda=tienda["slug"])
+                except Exception as exc:
+                    print("Error al descartar comprobante:", exc, flush=True)
+            raise
+        if numero is not None and not nuevo:
+            try:
+                historial.registrar(
+                    cliente,
+                    estado,
+                    fecha_valida,
+                    productos,
+                    plantilla=plantilla,
+                    pago_parcial=pago_parcial,
+                    tienda=tienda["slug"],
+                    id_local=id_local,
+                )
+            except Exception as exc:
+                print("Error al actualizar comprobante:", exc, flush=True)
+    # getvalue() copia los bytes: se cierran los buffers para no retener dos copias.
+    if artefactos["miniatura"] is not None:
+        with artefactos["miniatura"] as buffer:
+            _guardar_miniatura(tienda, clave, buffer.getvalue())
+    with artefactos["pdf"] as buffer:
+        return buffer.getvalue()
+
+
+def _guardar_miniatura(tienda, clave: str, datos: bytes) -> None:
+    directorio = os.path.join(MINIATURAS_DIR, tienda["slug"])
+    os.makedirs(directorio, exist_ok=True)
+    # Se escribe aparte y se renombra: otro worker nunca lee un PNG a medias.
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(datos)
+    os.replace(temporal, os.path.join(directorio, f"{clave}.png"))
+    _recortar_miniaturas(directorio, tienda["max_miniaturas"] or MAX_MINIATURAS)
+
+
+def _recortar_miniaturas(directorio: str, maximo: int) -> None:
+    """Borra las miniaturas más antiguas de la tienda por encima de 'maximo'."""
+    try:
+        entradas = [e for e in os.scandir(directorio) if e.name.endswith(".png")]
+        if len(entradas) <= maximo:
+            return
+        entradas.sort(key=lambda e: e.stat().st_mtime)
+    except OSError:
+        return
+    for entrada in entradas[:len(entradas) - maximo]:
+        try:
+            os.unlink(entrada.path)
+        except OSError:
+            continue
+
+
+def _obtener_miniatura(slug: str, clave: str):
+    """Ruta de la miniatura guardada, o None si no existe (o ya se recortó)."""
+    if not CLAVE_PATTERN.fullmatch(clave):
+        return None
+    ruta = os.path.join(MINIATURAS_DIR, slug, f"{clave}.png")
+    return ruta if os.path.isfile(ruta) else None
 
-        # === Nombre de salida: [CLIENTE]_Comprobante[FECHA].pdf ===
-        cliente_safe = _safe_nombre_cliente(cliente)
-        fecha_filename = fecha_valida.replace("/", "-")  # dd-mm-YYYY
-        filename = f"{cliente_safe}_Comprobante{fecha_filename}.pdf"
 
-        pdf_stream.seek(0)
+@app.route("/miniatura/<clave>", methods=["GET"])
+@app.route("/t/<tienda>/miniatura/<clave>", methods=["GET"])
+def miniatura(clave, tienda=None):
+    """Miniatura PNG generada junto con el PDF, leída del directorio común a los workers."""
+    ruta = _obtener_miniatura(_tienda_actual(tienda)["slug"], clave)
+    if ruta is None:
+        return "❌ La vista previa ya no está disponible.", 404
+    try:
+        return send_file(ruta, mimetype="image/png", download_name="comprobante.png")
+    except FileNotFoundError:
+        # Se recortó entre la comprobación y la lectura.
+        return "❌ La vista previa ya no está disponible.", 404
+
+
+def _exigir_admin():
+    if not perfilador.autorizado(request.headers.get("X-Perfil") or request.args.get("clave")):
+        abort(404)
+
+
+@app.route("/admin/perfiles", methods=["GET"])
+def listar_perfiles():
+    _exigir_admin()
+    perfiles = sorted(perfilador.listar(), key=lambda a: a["modificado"], reverse=True)
+    return jsonify(perfiles)
+
+
+@app.route("/admin/perfiles/<nombre>", methods=["GET"])
+def descargar_perfil(nombre):
+    _exigir_admin()
+    ruta = perfilador.ruta(nombre)
+    if ruta is None:
+        abort(404)
+    return send_file(ruta, as_attachment=True, download_name=nombre)
+
+
+@app.route("/metricas", methods=["GET"])
+def metricas():
+    # El limitador global solo aplica el tope de renders; la admisión por IP se
+    # cuenta en el de cada tienda.
+    globales = {
+        nombre: valor for nombre, valor in limitador.metricas().items()
+        if nombre not in ("admitidas", "rechazadas_tasa")
+    }
+    return jsonify({
+        "coalescencia": coalescedor.metricas(),
+        "limites": globales,
+        "tiendas": {slug: lim.metricas() for slug, lim in limitadores_tienda.items()},
+        "memoria": memoria.metricas(),
+    })
+
+
+@app.route("/reporte", methods=["GET"])
+@app.route("/t/<tienda>/reporte", methods=["GET"])
+@perfilador.perfilable
+def reporte(tienda=None):
+    """PDF de cierre: resumen de totales más todos los comprobantes del rango."""
+    _exigir_secreto_reporte()
+    tienda = _tienda_actual(tienda)
+    hoy = datetime.today().strftime("%Y-%m-%d")
+    plantilla = (request.args.get("plantilla") or "").upper() or None
+    try:
+        limitadores_tienda[tienda["slug"]].admitir(request.remote_addr or "desconocido")
+        desde = _fecha_reporte(request.args.get("desde") or hoy)
+        hasta = _fecha_reporte(request.args.get("hasta") or desde)
+        if desde > hasta:
+            raise ValidacionError("La fecha inicial no puede ser posterior a la final.")
+
+        datos = historial.resumen(desde, hasta, plantilla=plantilla, tienda=tienda["slug"])
+        if not datos["cantidad"]:
+            raise ValidacionError("No hay comprobantes registrados en ese rango de fechas.")
+
+        estimado = estimar_memoria_reporte(datos["cantidad"], datos["productos"])
+        memoria.admitir(estimado, "El reporte es demasiado grande; reduce el rango de fechas.")
+
+        with limitador.slot_render() as renovar_global, \
+                limitadores_tienda[tienda["slug"]].slot_render() as renovar_tienda, \
+                memoria.medir("reporte", estimado):
+            # Un reporte largo puede durar más que el TTL de los slots: se renuevan por bloque.
+            pdf_stream = generar_reporte(
+                datos,
+                historial.iterar_facturas(desde, hasta, plantilla=plantilla, tienda=tienda["slug"]),
+                procesar_fecha(desde),
+                procesar_fecha(hasta),
+                tema=plantilla or next(iter(tienda["plantillas"])),
+                deterministico=PDF_DETERMINISTA,
+                temas=tienda["plantillas"],
+                al_guardar_bloque=lambda: (renovar_global(), renovar_tienda()),
+            )
+        filename = f"Reporte_{desde}" + (f"_{hasta}" if hasta != desde else "") + ".pdf"
         return send_file(
             pdf_stream,
             mimetype="application/pdf",
@@ -151,15 +571,32 @@ def generar_desde_texto():
         )
     except ValidacionError as e:
         return f"❌ {e}", 422
+    except Rechazo as e:
+        return _respuesta_rechazo(e)
     except Exception as e:
-        print("Error /generar_desde_texto:", e, flush=True)
-        return f"❌ Error al procesar el mensaje: {e}", 500
+        print("Error /reporte:", e, flush=True)
+        return f"❌ Error al generar el reporte: {e}", 500
+
 
+def _exigir_secreto_reporte():
+    valor = request.headers.get("X-Reporte") or request.args.get("clave")
+    if not (REPORTE_SECRETO and valor and hmac.compare_digest(str(valor), REPORTE_SECRETO)):
+        abort(404)
 
-def parsear_mensaje(mensaje: str) -> Tuple[str, str, str, List[List[float]]]:
-    """Analiza el bloque de texto línea a línea para extraer datos y productos."""
+
+def _fecha_reporte(valor: str) -> str:
+    """Normaliza una fecha del reporte al formato ISO usado en el historial."""
+    return datetime.strptime(procesar_fecha(valor), "%d/%m/%Y").strftime("%Y-%m-%d")
+
+
+def parsear_mensaje(mensaje: str, catalogo: Optional[Dict[str, float]] = None) -> Tuple[str, str, str, List[List[float]]]:
+    """
+    Analiza el bloque de texto línea a línea para extraer datos y productos.
+    Con 'catalogo', las líneas sin precio toman el de la descripción registrada.
+    """
     if not mensaje or not mensaje.strip():
         raise ValidacionError("El mensaje está vacío.")
+    _validar_largo_mensaje(mensaje)
 
     cliente, estado, fecha = "", "", ""
     productos: List[List[float]] = []
@@ -169,6 +606,9 @@ def parsear_mensaje(mensaje: str) -> Tuple[str, str, str, List[List[float]]]:
     for numero, linea in enumerate(lineas, start=1):
         if not linea:
             continue
+        if len(linea) > MAX_LARGO_LINEA:
+            errores_producto.append(f"Línea {numero}: {_error_largo_linea()}")
+            continue
 
         encabezado = _extraer_encabezado(linea)
         if encabezado:
@@ -183,7 +623,7 @@ def parsear_mensaje(mensaje: str) -> Tuple[str, str, str, List[List[float]]]:
 
         if _parece_linea_producto(linea):
             try:
-                productos.append(_parsear_linea_producto(linea))
+                productos.append(_parsear_linea_producto(linea, catalogo))
             except ValidacionError as exc:
                 errores_producto.append(f"Línea {numero}: {exc}")
 
@@ -193,7 +633,7 @@ def parsear_mensaje(mensaje: str) -> Tuple[str, str, str, List[List[float]]]:
     return cliente.strip(), estado.strip(), fecha.strip(), productos
 
 
-def parsear_productos(texto: str) -> List[List[float]]:
+def parsear_productos(texto: str, catalogo: Optional[Dict[str, float]] = None) -> List[List[float]]:
     """Analiza únicamente las líneas de productos.
 
     Está pensado para el nuevo formulario guiado que ya recibe los datos
@@ -201,6 +641,7 @@ def parsear_productos(texto: str) -> List[List[float]]:
     """
     if texto is None:
         raise ValidacionError("Agrega al menos un producto.")
+    _validar_largo_mensaje(texto)
 
     lineas = [line.strip() for line in texto.splitlines()]
     productos: List[List[float]] = []
@@ -208,13 +649,16 @@ def parsear_productos(texto: str) -> List[List[float]]:
     for numero, linea in enumerate(lineas, start=1):
         if not linea:
             continue
+        if len(linea) > MAX_LARGO_LINEA:
+            errores.append(f"Línea {numero}: {_error_largo_linea()}")
+            continue
         if not _linea_formulario_valida(linea):
             errores.append(
                 f"Línea {numero}: Usa el formato '3 producto a 65', iniciando con la cantidad en números."
             )
             continue
         try:
-            productos.append(_parsear_linea_producto(linea))
+            productos.append(_parsear_linea_producto(linea, catalogo))
         except ValidacionError as exc:
             errores.append(f"Línea {numero}: {exc}")
 
@@ -225,6 +669,17 @@ def parsear_productos(texto: str) -> List[List[float]]:
     return productos
 
 
+def _validar_largo_mensaje(texto: str) -> None:
+    if len(texto) > MAX_LARGO_MENSAJE:
+        raise ValidacionError(
+            f"El texto es demasiado largo (máximo {MAX_LARGO_MENSAJE} caracteres)."
+        )
+
+
+def _error_largo_linea() -> str:
+    return f"La línea es demasiado larga (máximo {MAX_LARGO_LINEA} caracteres)."
+
+
 def _extraer_encabezado(linea: str):
     for campo, patron in HEADER_PATTERNS.items():
         match = patron.match(linea)
@@ -238,7 +693,7 @@ def _linea_formulario_valida(linea: str) -> bool:
     tokens = linea.split()
     if not tokens:
         return False
-    return tokens[0].isdigit()
+    return tokens[0].isdecimal()
 
 
 def _parece_linea_producto(linea: str) -> bool:
@@ -246,12 +701,12 @@ def _parece_linea_producto(linea: str) -> bool:
     if not tokens:
         return False
     primer = tokens[0].lower()
-    if primer.isdigit():
+    if primer.isdecimal():
         return True
     return primer in CANTIDAD_MAP
 
 
-def _parsear_linea_producto(linea: str) -> List[float]:
+def _parsear_linea_producto(linea: str, catalogo: Optional[Dict[str, float]] = None) -> List[float]:
     tokens = linea.split()
     cantidad, usados = _interpretar_cantidad(tokens)
     if cantidad is None:
@@ -263,6 +718,10 @@ def _parsear_linea_producto(linea: str) -> List[float]:
 
     precio_match = PRICE_PATTERN.search(resto)
     if not precio_match:
+        descripcion = _limpiar_conectores(resto)
+        if catalogo and descripcion.lower() in catalogo:
+            precio = catalogo[descripcion.lower()]
+            return [cantidad, descripcion, precio, cantidad * precio]
         raise ValidacionError("No se identificó el precio al final de la línea.")
 
     precio = _normalizar_precio(precio_match.group("precio"))
@@ -280,7 +739,7 @@ def _interpretar_cantidad(tokens: List[str]):
     if not tokens:
         return None, 0
     primer = tokens[0]
-    if primer.isdigit():
+    if primer.isdecimal():
         return int(primer), 1
 
     max_span = min(MAX_TOKENS_CANTIDAD, len(tokens))
@@ -297,8 +756,9 @@ def _normalizar_precio(valor: str) -> float:
     valor = valor.replace(" ", "")
     valor = valor.replace(",", ".")
     if valor.count(".") > 1:
-        partes = valor.split(".")
-        valor = "".join(partes[:-1]) + "." + partes[-1]
+        # Solo el último separador es decimal; los demás son de miles.
+        entero, _, decimales = valor.rpartition(".")
+        valor = entero.replace(".", "") + "." + decimales
     try:
         precio = float(valor)
     except ValueError as exc:
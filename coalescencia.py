@@ -0,0 +1,132 @@
+# coalescencia.py
+"""Deduplicación de renders idénticos que llegan al mismo tiempo (single-flight)."""
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo deduplicación entre hilos
+    fcntl = None
+
+
+def clave_pedido(*partes) -> str:
+    """Hash estable de los datos ya normalizados de un pedido."""
+    datos = json.dumps(partes, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+
+class _Vuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class Coalescedor:
+    """
+    Ejecuta una sola vez la función de render por clave mientras esté en curso;
+    las peticiones concurrentes con la misma clave esperan y comparten los bytes.
+
+    Con 'directorio' también se coordina entre workers: el primero toma un
+    bloqueo de archivo y publica el resultado, que los demás reutilizan
+    durante 'ventana' segundos.
+    """
+
+    def __init__(self, directorio=None, ventana=10.0):
+        self.directorio = directorio if fcntl else None
+        self.ventana = ventana
+        self._lock = threading.Lock()
+        self._en_curso = {}
+        self._renders = 0
+        self._ahorrados = 0
+        if self.directorio:
+            os.makedirs(self.directorio, exist_ok=True)
+
+    def ejecutar(self, clave, funcion) -> bytes:
+        with self._lock:
+            vuelo = self._en_curso.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._en_curso[clave] = _Vuelo()
+
+        if not lider:
+            vuelo.listo.wait()
+            self._contar(ahorrado=True)
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            if self.directorio:
+                vuelo.resultado = self._ejecutar_compartido(clave, funcion)
+            else:
+                vuelo.resultado = funcion()
+                self._contar(ahorrado=False)
+            return vuelo.resultado
+        except BaseException as exc:
+            vuelo.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._en_curso.pop(clave, None)
+            vuelo.listo.set()
+
+    def _ejecutar_compartido(self, clave, funcion) -> bytes:
+        ruta = os.path.join(self.directorio, f"{clave}.bin")
+        # Los bloqueos se reparten en 256 archivos fijos para no acumular uno por pedido.
+        with open(os.path.join(self.directorio, f"{clave[:2]}.lock"), "a") as bloqueo:
+            fcntl.flock(bloqueo, fcntl.LOCK_EX)
+            try:
+                try:
+                    if time.time() - os.path.getmtime(ruta) < self.ventana:
+                        with open(ruta, "rb") as f:
+                            datos = f.read()
+                        self._contar(ahorrado=True)
+                        return datos
+                except OSError:
+                    pass
+
+                datos = funcion()
+                self._contar(ahorrado=False)
+                temporal = f"{ruta}.{os.getpid()}.tmp"
+                with open(temporal, "wb") as f:
+                    f.write(datos)
+                os.replace(temporal, ruta)
+            finally:
+                fcntl.flock(bloqueo, fcntl.LOCK_UN)
+        self._limpiar()
+        return datos
+
+    def _limpiar(self):
+        """Borra los resultados publicados que ya salieron de la ventana."""
+        limite = time.time() - self.ventana
+        try:
+            entradas = list(os.scandir(self.directorio))
+        except OSError:
+            return
+        for entrada in entradas:
+            if not entrada.name.endswith(".bin"):
+                continue
+            try:
+                if entrada.stat().st_mtime < limite:
+                    os.unlink(entrada.path)
+            except OSError:
+                continue
+
+    def _contar(self, ahorrado):
+        with self._lock:
+            if ahorrado:
+                self._ahorrados += 1
+            else:
+                self._renders += 1
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "renders": self._renders,
+                "renders_ahorrados": self._ahorrados,
+                "en_curso": len(self._en_curso),
+            }
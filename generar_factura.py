@@ -1,6 +1,11 @@
 # generar_factura.py
+import hashlib
 import io
+import itertools
 import os
+import re
+import tempfile
+from functools import lru_cache
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
@@ -35,6 +40,13 @@ THEMES = {
     },
 }
 
+
+def _resolver_tema(tema):
+    """Acepta una clave de THEMES o directamente el diccionario de un tema (p. ej. de una tienda)."""
+    if isinstance(tema, dict):
+        return tema
+    return THEMES.get((tema or "A").upper(), THEMES["A"])
+
 # =========================
 # Constantes de layout
 # =========================
@@ -42,10 +54,48 @@ PAGE_WIDTH, PAGE_HEIGHT = letter
 _TEXT_X = 150
 _RIGHT_MARGIN = 36
 _MAX_TEXT_WIDTH = PAGE_WIDTH - _RIGHT_MARGIN - _TEXT_X  # ancho disponible a la derecha del logo
+
+# Posiciones del comprobante en puntos (origen abajo a la izquierda). Las usan
+# las funciones de dibujo y se publican en layout_spec() para el render offline.
+LAYOUT = {
+    "logo": {"x": 40, "y": 720, "w": 80, "h": 80},
+    "titulo": {"x": _TEXT_X, "y": 770, "size": 16},
+    "contacto": {
+        "x": _TEXT_X, "y": 750, "ancho": _MAX_TEXT_WIDTH,
+        "size": 10, "leading": 14,
+        # Dirección que no cabe en una línea a 10pt
+        "size_largo": 9, "leading_largo": 13,
+        "separacion": 2,
+    },
+    "datos": {"x": 50, "y": 700, "paso": 15, "size": 10, "numero_x": 500},
+    "tabla": {
+        "y": 640, "x": 50, "x_fin": 500, "size": 10,
+        "columnas": [50, 250, 350, 450],
+        "derechas": [300, 420, 500],
+        "bajo_cabecera": 5, "despues_cabecera": 20,
+        "ancho_descripcion": 180, "alto_linea": 18,
+        "sobre_separador": 10, "grosor_separador": 0.8,
+    },
+    "paginacion": {"y_minimo_filas": 100, "y_minimo_totales": 120, "y_nueva_pagina": 750},
+    # Desplazamientos hacia abajo desde la y donde terminan las filas
+    "totales": {
+        "x": 350, "x_fin": 500, "size": 12, "size_parcial": 10, "size_nota": 11, "nota_x": 50,
+        "total": 10, "linea": 15, "parcial": 30, "saldo": 45, "desplazamiento_parcial": 20,
+        "nota": 50, "gracias": 65,
+    },
+}
+
+TEXTOS = {
+    "cabecera_tabla": ["DESCRIPCIÓN", "CANTIDAD", "PRECIO", "TOTAL"],
+    "nota": "(Factura no contable con fines informativos.)",
+    "gracias": "¡Gracias por su compra, vuelva pronto!",
+}
 # Escala de la versión PNG respecto a la carta (en puntos)
 _PNG_SCALE = 2
-_IMAGE_WIDTH = int(PAGE_WIDTH * _PNG_SCALE)
-_IMAGE_HEIGHT = int(PAGE_HEIGHT * _PNG_SCALE)
+# Resolución del logo incrustado en el PDF respecto a su tamaño en puntos (3x ≈ 216 dpi).
+_LOGO_PDF_ESCALA = 3
+# Ancho en píxeles de la miniatura para compartir (WhatsApp)
+_THUMB_WIDTH = 360
 
 
 # =========================
@@ -95,8 +145,14 @@ _register_fonts()
 def _cap(s):
     return s[0].upper() + s[1:] if s else s
 
-def _try_logo(c, path, x=40, y=720, w=80, h=80):
+def _try_logo(c, path, x=None, y=None, w=None, h=None):
     """Dibuja el logo si existe; de lo contrario, muestra un marcador."""
+    caja = LAYOUT["logo"]
+    x = caja["x"] if x is None else x
+    y = caja["y"] if y is None else y
+    w = caja["w"] if w is None else w
+    h = caja["h"] if h is None else h
+
     def _placeholder():
         c.saveState()
         c.setStrokeColor(colors.Color(1, 1, 1, alpha=0.2))
@@ -115,11 +171,33 @@ def _try_logo(c, path, x=40, y=720, w=80, h=80):
             print(f"[factura] Logo no encontrado: {path}")
             _placeholder()
             return
-        img = ImageReader(path)
-        c.drawImage(img, x, y, width=w, height=h, mask='auto')
+        # El mismo lector (mismos datos) hace que ReportLab incruste el logo una sola vez por documento.
+        c.drawImage(_logo_pdf(path, round(w * _LOGO_PDF_ESCALA), round(h * _LOGO_PDF_ESCALA)),
+                    x, y, width=w, height=h, mask='auto')
     except Exception as exc:
         print(f"[factura] Error al cargar logo '{path}': {exc}")
         _placeholder()
+
+class _LogoReducido(ImageReader):
+    """Logo ya reducido para el PDF; conserva la ruta para que el render PNG use el original."""
+
+    def __init__(self, path, imagen):
+        super().__init__(imagen)
+        self.ruta = path
+
+
+@lru_cache(maxsize=16)
+def _logo_pdf(path, ancho, alto):
+    """
+    Decodifica el logo una sola vez por proceso y lo reduce al tamaño con que se
+    incrusta: el original (1708x1788 RGBA) ocupa ~12 MB decodificado y ~700 KB
+    dentro de cada PDF.
+    """
+    with Image.open(path) as original:
+        reducido = original.convert("RGBA").resize((ancho, alto), Image.LANCZOS)
+    logo = _LogoReducido(path, reducido)
+    logo.getRGBData()  # calcula ahora los datos y la máscara que ReportLab pide en cada render
+    return logo
 
 def _draw_wrapped(c, text, x, y, width, font=FONT_REGULAR, size=10, leading=14, color=colors.black, max_lines=None):
     """
@@ -144,96 +222,108 @@ def _encabezado(c, theme):
     _try_logo(c, theme.get("logo"))
 
     # Título
-    c.setFont(FONT_BOLD, 16)
+    titulo = LAYOUT["titulo"]
+    c.setFont(FONT_BOLD, titulo["size"])
     c.setFillColor(theme["primary"])
-    c.drawString(_TEXT_X, 770, theme.get("title", ""))
+    c.drawString(titulo["x"], titulo["y"], theme.get("title", ""))
 
     # Datos de contacto con wrap
-    y = 750
+    contacto = LAYOUT["contacto"]
+    x, ancho = contacto["x"], contacto["ancho"]
+    y = contacto["y"]
     c.setFillColor(colors.black)
 
     # Dirección (si es muy larga, baja a 9pt)
     dir_text = f"Dirección: {theme.get('address','')}"
-    if c.stringWidth(dir_text, FONT_REGULAR, 10) > _MAX_TEXT_WIDTH:
-        y = _draw_wrapped(c, dir_text, _TEXT_X, y, _MAX_TEXT_WIDTH, font=FONT_REGULAR, size=9, leading=13)
+    if c.stringWidth(dir_text, FONT_REGULAR, contacto["size"]) > ancho:
+        y = _draw_wrapped(c, dir_text, x, y, ancho, font=FONT_REGULAR,
+                          size=contacto["size_largo"], leading=contacto["leading_largo"])
     else:
-        y = _draw_wrapped(c, dir_text, _TEXT_X, y, _MAX_TEXT_WIDTH, font=FONT_REGULAR, size=10, leading=14)
+        y = _draw_wrapped(c, dir_text, x, y, ancho, font=FONT_REGULAR,
+                          size=contacto["size"], leading=contacto["leading"])
 
     # Teléfono con wrap por consistencia
     tel_text = f"Teléfono: {theme.get('phone','')}"
-    y -= 2
-    _draw_wrapped(c, tel_text, _TEXT_X, y, _MAX_TEXT_WIDTH, font=FONT_REGULAR, size=10, leading=14)
+    y -= contacto["separacion"]
+    _draw_wrapped(c, tel_text, x, y, ancho, font=FONT_REGULAR, size=contacto["size"], leading=contacto["leading"])
 
-def _datos_factura(c, theme, fecha, cliente, estado):
-    c.setFont(FONT_BOLD, 10)
+def _datos_factura(c, theme, fecha, cliente, estado, numero=None):
+    datos = LAYOUT["datos"]
+    x, y, paso = datos["x"], datos["y"], datos["paso"]
+    c.setFont(FONT_BOLD, datos["size"])
     c.setFillColor(theme["accent"])
-    c.drawString(50, 700, f"FECHA: {fecha}")
-    c.drawString(50, 685, f"CLIENTE: {cliente}")
-    c.drawString(50, 670, f"ESTADO: {estado}")
+    if numero is not None:
+        c.drawRightString(datos["numero_x"], y, f"No. {numero:06d}")
+    c.drawString(x, y, f"FECHA: {fecha}")
+    c.drawString(x, y - paso, f"CLIENTE: {cliente}")
+    c.drawString(x, y - 2 * paso, f"ESTADO: {estado}")
     c.setFillColor(colors.black)
 
 def _cabecera_tabla(c, y, theme):
-    c.setFont(FONT_BOLD, 10)
+    tabla = LAYOUT["tabla"]
+    c.setFont(FONT_BOLD, tabla["size"])
     c.setFillColor(theme["primary"])
-    c.drawString(50, y, "DESCRIPCIÓN")
-    c.drawString(250, y, "CANTIDAD")
-    c.drawString(350, y, "PRECIO")
-    c.drawString(450, y, "TOTAL")
+    for columna, titulo in zip(tabla["columnas"], TEXTOS["cabecera_tabla"]):
+        c.drawString(columna, y, titulo)
     c.setStrokeColor(theme["primary"])
     c.setLineWidth(1)
-    c.line(50, y - 5, 500, y - 5)
+    c.line(tabla["x"], y - tabla["bajo_cabecera"], tabla["x_fin"], y - tabla["bajo_cabecera"])
 
 def _filas(c, y, theme, productos):
-    c.setFont(FONT_REGULAR, 10)
+    tabla, paginacion = LAYOUT["tabla"], LAYOUT["paginacion"]
+    x_cantidad, x_precio, x_total = tabla["derechas"]
+    c.setFont(FONT_REGULAR, tabla["size"])
     total_factura = 0
     for cantidad, descripcion, precio, total in productos:
-        if y < 100:
+        if y < paginacion["y_minimo_filas"]:
             c.showPage()
-            y = 750
+            y = paginacion["y_nueva_pagina"]
             _cabecera_tabla(c, y, theme)
-            y -= 20
+            y -= tabla["despues_cabecera"]
 
-        desc_lines = simpleSplit(_cap(descripcion), FONT_REGULAR, 10, 180)
+        desc_lines = simpleSplit(_cap(descripcion), FONT_REGULAR, tabla["size"], tabla["ancho_descripcion"])
         for idx, line in enumerate(desc_lines):
             c.setFillColor(colors.black)
-            c.drawString(50, y, line)
+            c.drawString(tabla["x"], y, line)
             if idx == 0:
-                c.drawRightString(300, y, str(cantidad))
-                c.drawRightString(420, y, f"Q {precio:.2f}")
-                c.drawRightString(500, y, f"Q {total:.2f}")
-            y -= 18
+                c.drawRightString(x_cantidad, y, str(cantidad))
+                c.drawRightString(x_precio, y, f"Q {precio:.2f}")
+                c.drawRightString(x_total, y, f"Q {total:.2f}")
+            y -= tabla["alto_linea"]
 
         c.setStrokeColor(theme["line"])
-        c.setLineWidth(0.8)
-        c.line(50, y + 10, 500, y + 10)
+        c.setLineWidth(tabla["grosor_separador"])
+        c.line(tabla["x"], y + tabla["sobre_separador"], tabla["x_fin"], y + tabla["sobre_separador"])
         c.setLineWidth(0.5)
         total_factura += total
     return y, total_factura
 
 def _totales_y_nota(c, y, theme, total_factura, pago_parcial=0.0):
-    if y < 120:
+    totales, paginacion = LAYOUT["totales"], LAYOUT["paginacion"]
+    x, x_fin = totales["x"], totales["x_fin"]
+    if y < paginacion["y_minimo_totales"]:
         c.showPage()
-        y = 750
-    c.setFont(FONT_BOLD, 12)
+        y = paginacion["y_nueva_pagina"]
+    c.setFont(FONT_BOLD, totales["size"])
     c.setFillColor(theme["primary"])
-    c.drawString(350, y - 10, "TOTAL:")
-    c.drawRightString(500, y - 10, f"Q {total_factura:,.2f}")
-    c.line(350, y - 15, 500, y - 15)
+    c.drawString(x, y - totales["total"], "TOTAL:")
+    c.drawRightString(x_fin, y - totales["total"], f"Q {total_factura:,.2f}")
+    c.line(x, y - totales["linea"], x_fin, y - totales["linea"])
 
     if pago_parcial:
         saldo = max(total_factura - pago_parcial, 0)
-        c.setFont(FONT_REGULAR, 10)
+        c.setFont(FONT_REGULAR, totales["size_parcial"])
         c.setFillColor(theme["accent"])
-        c.drawString(350, y - 30, "Pago parcial:")
-        c.drawRightString(500, y - 30, f"Q {pago_parcial:,.2f}")
-        c.drawString(350, y - 45, "Saldo pendiente:")
-        c.drawRightString(500, y - 45, f"Q {saldo:,.2f}")
-        y -= 20
+        c.drawString(x, y - totales["parcial"], "Pago parcial:")
+        c.drawRightString(x_fin, y - totales["parcial"], f"Q {pago_parcial:,.2f}")
+        c.drawString(x, y - totales["saldo"], "Saldo pendiente:")
+        c.drawRightString(x_fin, y - totales["saldo"], f"Q {saldo:,.2f}")
+        y -= totales["desplazamiento_parcial"]
 
-    c.setFont(FONT_ITALIC, 11)
+    c.setFont(FONT_ITALIC, totales["size_nota"])
     c.setFillColor(theme["note"])
-    c.drawString(50, y - 50, "(Factura no contable con fines informativos.)")
-    c.drawString(50, y - 65, "¡Gracias por su compra, vuelva pronto!")
+    c.drawString(totales["nota_x"], y - totales["nota"], TEXTOS["nota"])
+    c.drawString(totales["nota_x"], y - totales["gracias"], TEXTOS["gracias"])
 
 
 # =========================
@@ -261,202 +351,629 @@ def _color_to_rgb(color, default=(0, 0, 0)):
     return default
 
 
-def _load_font(size=24, bold=False):
-    base = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+@lru_cache(maxsize=64)
+def _load_font(size=24, bold=False, italic=False):
+    if bold:
+        base = "DejaVuSans-Bold.ttf"
+    elif italic:
+        base = "DejaVuSans-Oblique.ttf"
+    else:
+        base = "DejaVuSans.ttf"
     paths = [
         f"/usr/share/fonts/truetype/dejavu/{base}",
         base,
     ]
+    if italic:
+        paths.append("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
     for path in paths:
         try:
             return ImageFont.truetype(path, size=size)
         except (OSError, IOError):
             continue
-    return ImageFont.load_default()
-
-
-def _draw_right(draw, text, x, y, font, fill):
-    bbox = draw.textbbox((0, 0), text, font=font)
-    width = bbox[2] - bbox[0]
-    draw.text((x - width, y), text, font=font, fill=fill)
-
-
-def _wrap_for_width(draw, text, font, max_width):
-    if not text:
-        return []
-    words = text.split()
-    lines = []
-    current = []
-    for word in words:
-        trial = " ".join(current + [word])
-        length = draw.textlength(trial, font=font)
-        if length <= max_width or not current:
-            current.append(word)
+    return ImageFont.load_default(size)
+
+
+def _fuente_png(nombre, size, escala):
+    """Fuente PIL equivalente a la fuente PDF 'nombre' a la escala indicada."""
+    return _load_font(
+        max(1, round(size * escala)),
+        bold="Bold" in nombre,
+        italic="Italic" in nombre or "Oblique" in nombre,
+    )
+
+
+@lru_cache(maxsize=16)
+def _logo_png(path, size):
+    """Logo decodificado y reducido una sola vez por ruta y tamaño."""
+    with Image.open(path) as original:
+        return original.convert("RGBA").resize(size, Image.LANCZOS)
+
+
+class _Grabadora:
+    """
+    Envoltura del canvas que reenvía cada llamada y guarda las operaciones de
+    dibujo por página. Así el layout (saltos de línea, métricas, paginación)
+    se calcula una sola vez y sirve tanto para el PDF como para las imágenes.
+    Sin canvas ('c=None') solo se graba; con 'max_paginas' se dejan de grabar
+    las páginas siguientes (que igual se dibujan en el canvas).
+    """
+
+    _OPERACIONES = (
+        "setFont", "setFillColor", "setStrokeColor", "setLineWidth",
+        "drawString", "drawRightString", "drawCentredString",
+        "line", "rect", "drawImage", "saveState", "restoreState",
+    )
+
+    def __init__(self, c=None, max_paginas=None):
+        self._c = c
+        self.max_paginas = max_paginas
+        self.paginas = [[]]
+        self._pagina = self.paginas[0]
+
+    def showPage(self):
+        if self.max_paginas is None or len(self.paginas) < self.max_paginas:
+            self._pagina = []
+            self.paginas.append(self._pagina)
         else:
-            lines.append(" ".join(current))
-            current = [word]
-    if current:
-        lines.append(" ".join(current))
-    return lines or [text]
+            self._pagina = None
+        if self._c is not None:
+            self._c.showPage()
+
+    def soltar(self):
+        """Deja de reenviar al canvas para que pueda liberarse tras guardarlo."""
+        self._c = None
+
+    def stringWidth(self, text, font, size):
+        return pdfmetrics.stringWidth(text, font, size)
+
+
+def _grabar(nombre):
+    def operacion(self, *args, **kwargs):
+        if self._pagina is not None:
+            self._pagina.append((nombre, args, kwargs))
+        if self._c is not None:
+            return getattr(self._c, nombre)(*args, **kwargs)
+    operacion.__name__ = nombre
+    return operacion
 
 
-def _text_height(font, extra=6):
-    """Calcula la altura aproximada de una línea para el font indicado."""
-    bbox = font.getbbox("Ag")
-    return (bbox[3] - bbox[1]) + extra
+for _nombre in _Grabadora._OPERACIONES:
+    setattr(_Grabadora, _nombre, _grabar(_nombre))
 
+_ANCLAS_TEXTO = {"drawString": "ls", "drawRightString": "rs", "drawCentredString": "ms"}
 
-def generar_imagen_factura(cliente, estado, fecha, productos, tema="A", pago_parcial=0.0):
-    """Genera una imagen con composición similar al PDF para mantener consistencia."""
 
-    theme = THEMES.get(tema.upper(), THEMES["A"])
-    img = Image.new("RGB", (_IMAGE_WIDTH, _IMAGE_HEIGHT), "white")
+def _rasterizar(operaciones, escala):
+    """Dibuja con PIL las operaciones grabadas de una página; devuelve la imagen recortada."""
+    img = Image.new("RGB", (round(PAGE_WIDTH * escala), round(PAGE_HEIGHT * escala)), "white")
     draw = ImageDraw.Draw(img)
 
-    title_font = _load_font(42, bold=True)
-    subtitle_font = _load_font(24)
-    body_font = _load_font(24)
-    bold_font = _load_font(24, bold=True)
-    small_font = _load_font(20)
-
-    primary = _color_to_rgb(theme.get("primary"), (15, 76, 129))
-    accent = _color_to_rgb(theme.get("accent"), (51, 65, 85))
-    note_color = _color_to_rgb(theme.get("note"), (55, 65, 81))
-
-    padding = int(36 * _PNG_SCALE)
-    col_desc = int(50 * _PNG_SCALE)
-    col_qty = int(300 * _PNG_SCALE)
-    col_price = int(420 * _PNG_SCALE)
-    col_total = int(500 * _PNG_SCALE)
-    table_right = _IMAGE_WIDTH - padding
-
-    # Logo y cabecera
-    logo_x = int(40 * _PNG_SCALE)
-    logo_y = int(40 * _PNG_SCALE)
-    logo_box = int(90 * _PNG_SCALE)
-    text_x = logo_x + logo_box + int(32 * _PNG_SCALE)
-    y = logo_y
-
-    logo_path = theme.get("logo")
-    if logo_path and os.path.exists(logo_path):
-        try:
-            logo = Image.open(logo_path).convert("RGBA")
-            logo = logo.resize((logo_box, logo_box), Image.LANCZOS)
-            img.paste(logo, (logo_x, logo_y), logo)
-        except Exception:
-            pass
-    else:
-        draw.rectangle([logo_x, logo_y, logo_x + logo_box, logo_y + logo_box], outline=(210, 210, 210), width=3)
-
-    draw.text((text_x, y), theme.get("title", ""), fill=primary, font=title_font)
-    y += _text_height(title_font)
-
-    info_width = _IMAGE_WIDTH - text_x - padding
-    direccion = f"Dirección: {theme.get('address', '')}"
-    telefono = f"Teléfono: {theme.get('phone', '')}"
-    for line in _wrap_for_width(draw, direccion, subtitle_font, info_width):
-        draw.text((text_x, y), line, fill=(55, 65, 81), font=subtitle_font)
-        y += _text_height(subtitle_font, extra=4)
-    for line in _wrap_for_width(draw, telefono, subtitle_font, info_width):
-        draw.text((text_x, y), line, fill=(55, 65, 81), font=subtitle_font)
-        y += _text_height(subtitle_font, extra=4)
-
-    y = max(y, logo_y + logo_box) + int(32 * _PNG_SCALE)
-
-    # Datos del cliente
-    draw.text((col_desc, y), f"FECHA: {fecha}", font=bold_font, fill=accent)
-    y += _text_height(bold_font, extra=6)
-    draw.text((col_desc, y), f"CLIENTE: {cliente}", font=bold_font, fill=accent)
-    y += _text_height(bold_font, extra=6)
-    draw.text((col_desc, y), f"ESTADO: {estado}", font=bold_font, fill=accent)
-    y += _text_height(bold_font, extra=12)
-
-    # Cabecera tabla
-    draw.line((col_desc, y, table_right, y), fill=primary, width=3)
-    y += int(10 * _PNG_SCALE)
-    draw.text((col_desc, y), "DESCRIPCIÓN", font=bold_font, fill=primary)
-    _draw_right(draw, "CANTIDAD", col_qty + int(20 * _PNG_SCALE), y, bold_font, primary)
-    _draw_right(draw, "PRECIO", col_price + int(50 * _PNG_SCALE), y, bold_font, primary)
-    _draw_right(draw, "TOTAL", col_total + int(80 * _PNG_SCALE), y, bold_font, primary)
-    y += _text_height(bold_font, extra=12)
-    draw.line((col_desc, y, table_right, y), fill=primary, width=2)
-    y += int(15 * _PNG_SCALE)
-
-    total_factura = 0
-    descripcion_ancho = col_qty - col_desc - int(20 * _PNG_SCALE)
-    linea_altura = _text_height(body_font, extra=8)
-
-    for cantidad, descripcion, precio, total in productos:
-        lineas_desc = _wrap_for_width(draw, _cap(descripcion), body_font, descripcion_ancho)
-        for idx, line in enumerate(lineas_desc):
-            draw.text((col_desc, y), line, font=body_font, fill=(31, 41, 55))
-            if idx == 0:
-                _draw_right(draw, str(cantidad), col_qty, y, body_font, (31, 41, 55))
-                _draw_right(draw, f"Q {precio:,.2f}", col_price + int(60 * _PNG_SCALE), y, body_font, (31, 41, 55))
-                _draw_right(draw, f"Q {total:,.2f}", col_total + int(100 * _PNG_SCALE), y, body_font, (31, 41, 55))
-            y += linea_altura
-        total_factura += total
-        draw.line((col_desc, y - 6, table_right, y - 6), fill=(226, 232, 240), width=2)
-        y += int(4 * _PNG_SCALE)
-        if y > _IMAGE_HEIGHT - int(200 * _PNG_SCALE):
-            break
+    def px(x, y):
+        return round(x * escala), round((PAGE_HEIGHT - y) * escala)
+
+    estado = {"font": (FONT_REGULAR, 10), "fill": (0, 0, 0), "stroke": (0, 0, 0), "width": 1}
+    pila = []
+    inferior = PAGE_HEIGHT
+    for nombre, args, kwargs in operaciones:
+        if nombre == "setFont":
+            estado["font"] = (args[0], args[1])
+        elif nombre == "setFillColor":
+            estado["fill"] = _color_to_rgb(args[0])
+        elif nombre == "setStrokeColor":
+            estado["stroke"] = _color_to_rgb(args[0])
+        elif nombre == "setLineWidth":
+            estado["width"] = args[0]
+        elif nombre == "saveState":
+            pila.append(dict(estado))
+        elif nombre == "restoreState":
+            estado = pila.pop()
+        elif nombre in _ANCLAS_TEXTO:
+            x, y, texto = args[:3]
+            fuente = _fuente_png(*estado["font"], escala)
+            draw.text(px(x, y), texto, font=fuente, fill=estado["fill"], anchor=_ANCLAS_TEXTO[nombre])
+            inferior = min(inferior, y - estado["font"][1] / 2)
+        elif nombre == "line":
+            x1, y1, x2, y2 = args[:4]
+            draw.line(px(x1, y1) + px(x2, y2), fill=estado["stroke"], width=max(1, round(estado["width"] * escala)))
+            inferior = min(inferior, y1, y2)
+        elif nombre == "rect":
+            x, y, w, h = args[:4]
+            draw.rectangle(px(x, y + h) + px(x + w, y), outline=estado["stroke"])
+        elif nombre == "drawImage":
+            path, x, y = args[:3]
+            path = getattr(path, "ruta", path)
+            w, h = kwargs["width"], kwargs["height"]
+            try:
+                logo = _logo_png(path, (round(w * escala), round(h * escala)))
+                img.paste(logo, px(x, y + h), logo)
+            except Exception as exc:
+                print(f"[factura] Error al cargar logo '{path}' para imagen: {exc}")
 
-    # Totales
-    y += int(10 * _PNG_SCALE)
-    draw.text((col_desc, y), "TOTAL:", font=bold_font, fill=primary)
-    _draw_right(draw, f"Q {total_factura:,.2f}", col_total + int(100 * _PNG_SCALE), y, bold_font, primary)
-    y += _text_height(bold_font, extra=12)
+    contenido = min(max(PAGE_HEIGHT - inferior + 20, 520), PAGE_HEIGHT)
+    if contenido < PAGE_HEIGHT:
+        recorte = img.crop((0, 0, img.width, round(contenido * escala)))
+        img.close()
+        img = recorte
+    return img
 
-    if pago_parcial:
-        saldo = max(total_factura - pago_parcial, 0)
-        draw.text((col_desc, y), "Pago parcial:", font=body_font, fill=accent)
-        _draw_right(draw, f"Q {pago_parcial:,.2f}", col_total + int(100 * _PNG_SCALE), y, body_font, accent)
-        y += linea_altura
-        draw.text((col_desc, y), "Saldo pendiente:", font=body_font, fill=accent)
-        _draw_right(draw, f"Q {saldo:,.2f}", col_total + int(100 * _PNG_SCALE), y, body_font, accent)
-        y += linea_altura
-
-    draw.text((col_desc, y), "(Factura no contable con fines informativos.)", font=small_font, fill=note_color)
-    y += _text_height(small_font, extra=8)
-    draw.text((col_desc, y), "¡Gracias por su compra, vuelva pronto!", font=small_font, fill=note_color)
-    y += _text_height(small_font, extra=12)
-
-    contenido_util = min(max(int(y + 40), int(520 * _PNG_SCALE)), _IMAGE_HEIGHT)
-    if contenido_util < _IMAGE_HEIGHT:
-        img = img.crop((0, 0, _IMAGE_WIDTH, contenido_util))
 
+def _png_bytes(img):
+    """Codifica la imagen como PNG y libera sus píxeles (a 2x son ~5.8 MB)."""
     buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
+    try:
+        img.save(buffer, format="PNG")
+    finally:
+        img.close()
     buffer.seek(0)
     return buffer
+
+
+def generar_imagen_factura(cliente, estado, fecha, productos, tema="A", pago_parcial=0.0, numero=None):
+    """Genera una imagen con composición idéntica a la primera página del PDF."""
+    theme = _resolver_tema(tema)
+    grabadora = _Grabadora(max_paginas=1)
+    _dibujar_factura(grabadora, theme, cliente, estado, fecha, productos, pago_parcial=pago_parcial, numero=numero)
+    return _png_bytes(_rasterizar(grabadora.paginas[0], _PNG_SCALE))
 
 # =========================
 # Generadores
 # =========================
-def generar_factura(cliente, estado, fecha, productos, tema="A", pago_parcial=0.0):
-    """
-    Generador genérico. Cambia 'tema' a 'A' o 'B' (o agrega más en THEMES).
-    """
-    theme = THEMES.get(tema.upper(), THEMES["A"])
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-
+def _dibujar_factura(c, theme, cliente, estado, fecha, productos, pago_parcial=0.0, numero=None):
     _encabezado(c, theme)
-    _datos_factura(c, theme, fecha, cliente, estado)
+    _datos_factura(c, theme, fecha, cliente, estado, numero=numero)
 
-    y = 640
+    y = LAYOUT["tabla"]["y"]
     _cabecera_tabla(c, y, theme)
-    y -= 20
+    y -= LAYOUT["tabla"]["despues_cabecera"]
 
     y, total_factura = _filas(c, y, theme, productos)
     _totales_y_nota(c, y, theme, total_factura, pago_parcial=pago_parcial)
+
+
+def _nuevo_canvas(buffer, theme, deterministico=False):
+    """
+    Canvas carta con metadatos fijos. En modo determinista ReportLab no incrusta
+    la fecha de creación ni un ID aleatorio, así que los mismos datos producen
+    exactamente los mismos bytes (útil para hashes, caché HTTP y pruebas golden).
+    """
+    c = canvas.Canvas(buffer, pagesize=letter, invariant=1 if deterministico else None)
+    c.setTitle("Comprobante")
+    c.setAuthor(theme.get("title", ""))
+    c.setCreator("generar_factura")
+    return c
+
+def generar_factura(cliente, estado, fecha, productos, tema="A", pago_parcial=0.0, deterministico=False,
+                    numero=None):
+    """
+    Generador genérico. Cambia 'tema' a 'A' o 'B' (o agrega más en THEMES),
+    o pasa directamente el diccionario del tema de una tienda.
+    """
+    theme = _resolver_tema(tema)
+    buffer = io.BytesIO()
+    c = _nuevo_canvas(buffer, theme, deterministico)
+
+    _dibujar_factura(c, theme, cliente, estado, fecha, productos, pago_parcial=pago_parcial, numero=numero)
 
     c.save()
     buffer.seek(0)
     return buffer
 
-def generar_factura_A(cliente, estado, fecha, productos, pago_parcial=0.0):
-    return generar_factura(cliente, estado, fecha, productos, tema="A", pago_parcial=pago_parcial)
+def generar_artefactos(cliente, estado, fecha, productos, tema="A", pago_parcial=0.0,
+                       miniatura=True, png=False, ancho_miniatura=_THUMB_WIDTH, deterministico=False,
+                       numero=None):
+    """
+    Genera en una sola pasada de layout el PDF y, opcionalmente, la miniatura
+    y el PNG a tamaño completo de la primera página.
+    Devuelve {"pdf": BytesIO, "miniatura": BytesIO | None, "png": BytesIO | None}.
+    """
+    theme = _resolver_tema(tema)
+    buffer = io.BytesIO()
+    c = _nuevo_canvas(buffer, theme, deterministico)
+    # Solo se rasteriza la primera página: no hace falta grabar las demás.
+    grabadora = _Grabadora(c, max_paginas=1) if (miniatura or png) else None
 
-def generar_factura_B(cliente, estado, fecha, productos, pago_parcial=0.0):
-    return generar_factura(cliente, estado, fecha, productos, tema="B", pago_parcial=pago_parcial)
+    _dibujar_factura(grabadora or c, theme, cliente, estado, fecha, productos, pago_parcial=pago_parcial,
+                     numero=numero)
+
+    c.save()
+    buffer.seek(0)
+    # El canvas retiene las páginas y fuentes del documento ya escrito en 'buffer';
+    # se suelta antes de rasterizar para no sumar su memoria a la de las imágenes.
+    del c
+    artefactos = {"pdf": buffer, "miniatura": None, "png": None}
+    if grabadora is None:
+        return artefactos
+
+    grabadora.soltar()
+    if miniatura:
+        escala = ancho_miniatura / PAGE_WIDTH
+        artefactos["miniatura"] = _png_bytes(_rasterizar(grabadora.paginas[0], escala))
+    if png:
+        artefactos["png"] = _png_bytes(_rasterizar(grabadora.paginas[0], _PNG_SCALE))
+    return artefactos
+
+def generar_factura_A(cliente, estado, fecha, productos, pago_parcial=0.0, deterministico=False):
+    return generar_factura(cliente, estado, fecha, productos, tema="A", pago_parcial=pago_parcial,
+                           deterministico=deterministico)
+
+def generar_factura_B(cliente, estado, fecha, productos, pago_parcial=0.0, deterministico=False):
+    return generar_factura(cliente, estado, fecha, productos, tema="B", pago_parcial=pago_parcial,
+                           deterministico=deterministico)
+
+
+# =========================
+# Estimación de memoria
+# =========================
+# Costos aproximados medidos con tracemalloc sobre generar_artefactos() y
+# generar_reporte(); memoria.ControlMemoria registra el pico real por muestreo.
+_MEMORIA_BASE = 2 * 1024 * 1024       # canvas, fuentes, logo y buffer del PDF
+_MEMORIA_POR_PRODUCTO = 1024          # fila del pedido y sus operaciones en el canvas
+_MEMORIA_POR_COMPROBANTE = 16 * 1024  # página que el canvas del bloque retiene hasta guardar
+
+
+def _memoria_imagen(ancho):
+    # Página completa en RGB; el recorte y la codificación PNG llegan a duplicarla.
+    return 2 * 3 * ancho * round(ancho * PAGE_HEIGHT / PAGE_WIDTH)
+
+
+def estimar_memoria_factura(productos, miniatura=False, png=False, ancho_miniatura=_THUMB_WIDTH):
+    """Bytes que se estima ocupa generar_artefactos() con 'productos' filas."""
+    total = _MEMORIA_BASE + productos * _MEMORIA_POR_PRODUCTO
+    if miniatura:
+        total += _memoria_imagen(ancho_miniatura)
+    if png:
+        total += _memoria_imagen(round(PAGE_WIDTH * _PNG_SCALE))
+    return total
+
+
+def estimar_memoria_reporte(comprobantes, productos):
+    """
+    Bytes que se estima ocupa generar_reporte(): solo un bloque de comprobantes
+    vive en memoria a la vez, así que deja de crecer pasado _COMPROBANTES_POR_BLOQUE.
+    """
+    if not comprobantes:
+        return _MEMORIA_BASE
+    en_bloque = min(comprobantes, _COMPROBANTES_POR_BLOQUE)
+    productos_bloque = -(-productos * en_bloque // comprobantes)
+    return _MEMORIA_BASE + en_bloque * _MEMORIA_POR_COMPROBANTE + productos_bloque * _MEMORIA_POR_PRODUCTO
+
+
+# =========================
+# Layout para el render offline
+# =========================
+# Subir al cambiar el significado de LAYOUT o de layout_spec(); el render del
+# navegador no dibuja con una versión que no conoce.
+LAYOUT_VERSION = 1
+
+# El navegador no incrusta fuentes: usa las estándar de PDF con WinAnsiEncoding.
+_FUENTES_CLIENTE = {"regular": "Helvetica", "bold": "Helvetica-Bold", "italic": "Times-Italic"}
+
+
+def _anchos_winansi(fuente):
+    """Ancho (milésimas de em) de cada código 32-255 de WinAnsi; 0 si el código no tiene glifo."""
+    anchos = []
+    for codigo in range(32, 256):
+        try:
+            caracter = bytes([codigo]).decode("cp1252")
+        except UnicodeDecodeError:
+            anchos.append(0)
+            continue
+        anchos.append(round(pdfmetrics.stringWidth(caracter, fuente, 1000), 3))
+    return anchos
+
+
+def _color_hex(color):
+    return "#%02x%02x%02x" % _color_to_rgb(color)
+
+
+def layout_spec(temas=None):
+    """
+    Especificación JSON del comprobante para dibujarlo en el navegador sin
+    conexión: posiciones de LAYOUT, textos fijos, fuentes con sus anchos y los
+    colores y datos de cada plantilla. Los logos se publican como URL.
+    """
+    temas = temas or THEMES
+    plantillas = {}
+    for clave, tema in temas.items():
+        logo = tema.get("logo") or ""
+        plantillas[clave] = {
+            "titulo": tema.get("title", ""),
+            "direccion": tema.get("address", ""),
+            "telefono": tema.get("phone", ""),
+            "logo": "/" + logo if logo.startswith("static/") and os.path.exists(logo) else None,
+            "colores": {nombre: _color_hex(tema[nombre]) for nombre in ("primary", "accent", "note", "line")},
+        }
+    return {
+        "version": LAYOUT_VERSION,
+        "pagina": [PAGE_WIDTH, PAGE_HEIGHT],
+        "layout": LAYOUT,
+        "textos": TEXTOS,
+        "fuentes": {
+            rol: {"nombre": nombre, "anchos": _anchos_winansi(nombre)}
+            for rol, nombre in _FUENTES_CLIENTE.items()
+        },
+        "plantillas": plantillas,
+    }
+
+
+# =========================
+# Reporte de cierre
+# =========================
+def _resumen_tabla(c, y, titulo, filas, clave, theme):
+    """Dibuja una tabla de totales agrupados; devuelve la nueva coordenada y."""
+    if y < 160:
+        c.showPage()
+        y = 750
+    c.setFont(FONT_BOLD, 12)
+    c.setFillColor(theme["primary"])
+    c.drawString(50, y, titulo)
+    y -= 22
+    c.setFont(FONT_BOLD, 10)
+    c.drawString(50, y, clave.upper())
+    c.drawRightString(330, y, "CANT.")
+    c.drawRightString(420, y, "TOTAL")
+    c.drawRightString(500, y, "SALDO")
+    c.setStrokeColor(theme["primary"])
+    c.setLineWidth(1)
+    c.line(50, y - 5, 500, y - 5)
+    y -= 20
+
+    c.setFillColor(colors.black)
+    for fila in filas:
+        if y < 100:
+            c.showPage()
+            y = 750
+        c.setFont(FONT_REGULAR, 10)
+        nombre = simpleSplit(str(fila[clave]), FONT_REGULAR, 10, 240)[:1]
+        c.drawString(50, y, nombre[0] if nombre else "")
+        c.drawRightString(330, y, str(fila["cantidad"]))
+        c.drawRightString(420, y, f"Q {fila['total']:,.2f}")
+        c.drawRightString(500, y, f"Q {fila['saldo']:,.2f}")
+        y -= 16
+    return y - 20
+
+
+def _pagina_resumen(c, theme, resumen, desde, hasta):
+    _encabezado(c, theme)
+
+    c.setFont(FONT_BOLD, 14)
+    c.setFillColor(theme["primary"])
+    c.drawString(50, 690, "REPORTE DE CIERRE")
+    c.setFont(FONT_BOLD, 10)
+    c.setFillColor(theme["accent"])
+    periodo = desde if desde == hasta else f"{desde} al {hasta}"
+    c.drawString(50, 672, f"PERIODO: {periodo}")
+    c.drawString(50, 657, f"COMPROBANTES: {resumen['cantidad']}")
+
+    c.setFont(FONT_BOLD, 12)
+    c.setFillColor(theme["primary"])
+    c.drawString(300, 672, "TOTAL:")
+    c.drawRightString(500, 672, f"Q {resumen['total']:,.2f}")
+    c.setFont(FONT_REGULAR, 10)
+    c.setFillColor(theme["accent"])
+    c.drawString(300, 657, "Pagos parciales:")
+    c.drawRightString(500, 657, f"Q {resumen['abonado']:,.2f}")
+    c.drawString(300, 642, "Saldo pendiente:")
+    c.drawRightString(500, 642, f"Q {resumen['saldo']:,.2f}")
+
+    y = _resumen_tabla(c, 610, "Por estado", resumen["por_estado"], "estado", theme)
+    _resumen_tabla(c, y, "Por cliente", resumen["por_cliente"], "cliente", theme)
+
+
+# Comprobantes por canvas en el reporte: cada bloque se guarda y se vuelca al
+# archivo de salida antes de dibujar el siguiente.
+_COMPROBANTES_POR_BLOQUE = 100
+
+
+def generar_reporte(resumen, facturas, desde, hasta, tema="A", deterministico=False, temas=None,
+                    al_guardar_bloque=None):
+    """
+    Une en un solo PDF la página de resumen y los comprobantes de 'facturas'.
+
+    'facturas' puede ser un iterador. Se dibujan en bloques de
+    _COMPROBANTES_POR_BLOQUE con un canvas por bloque (ReportLab retiene las
+    páginas hasta guardar) y cada bloque se copia a un archivo temporal, así la
+    memoria no crece con el rango. Fuentes y logos se incrustan una vez por
+    bloque. 'temas' reemplaza a THEMES para buscar la plantilla de cada
+    comprobante (temas de una tienda). 'al_guardar_bloque' se llama tras volcar
+    cada bloque (por ejemplo, para renovar el slot de render).
+
+    Devuelve el archivo temporal abierto y rebobinado; se borra al cerrarlo.
+    """
+    temas = temas or THEMES
+    theme_resumen = temas.get((tema or "A").upper()) or _resolver_tema(tema)
+    facturas = iter(facturas)
+    salida = tempfile.TemporaryFile()
+    union = _UnionPdf(salida)
+
+    for bloque in itertools.count():
+        buffer = io.BytesIO()
+        c = _nuevo_canvas(buffer, theme_resumen, deterministico)
+        if bloque == 0:
+            _pagina_resumen(c, theme_resumen, resumen, desde, hasta)
+
+        dibujadas = 0
+        for factura in itertools.islice(facturas, _COMPROBANTES_POR_BLOQUE):
+            if bloque == 0 or dibujadas:
+                c.showPage()
+            theme = temas.get(factura["plantilla"].upper(), theme_resumen)
+            _dibujar_factura(
+                c,
+                theme,
+                factura["cliente"],
+                factura["estado"],
+                factura["fecha"],
+                factura["productos"],
+                pago_parcial=factura["pago_parcial"],
+                numero=factura.get("numero"),
+            )
+            dibujadas += 1
+
+        if bloque and not dibujadas:
+            break
+        c.save()
+        del c
+        union.agregar(buffer.getvalue())
+        buffer.close()
+        if al_guardar_bloque is not None:
+            al_guardar_bloque()
+        if dibujadas < _COMPROBANTES_POR_BLOQUE:
+            break
+
+    union.cerrar()
+    salida.seek(0)
+    return salida
+
+
+class _UnionPdf:
+    """
+    Concatena en 'destino' los PDFs que genera ReportLab, uno a la vez.
+
+    Copia los objetos de cada parte renumerados, sin su catálogo ni su /Info
+    (se conserva el /Info de la primera), y cuelga el árbol de páginas de cada
+    parte de una raíz común. En memoria solo quedan la parte en curso, la
+    posición de cada objeto escrito para la tabla xref y la huella de cada
+    imagen ya escrita.
+
+    Las imágenes idénticas (el logo de cada bloque) se escriben una sola vez y
+    las demás partes apuntan a esa copia. Los subconjuntos de fuente no se
+    pueden compartir porque cada parte incluye solo sus glifos; ReportLab los
+    etiqueta a todos AAAAAA+, así que cada uno recibe aquí una etiqueta propia.
+    """
+
+    _OBJETO = re.compile(rb"(\d+) 0 obj\r?\n")
+    _REFERENCIA = re.compile(rb"(\d+) 0 R\b")
+    _XREF = re.compile(rb"xref\r?\n0 (\d+)\r?\n")
+    _TRAILER = re.compile(rb"trailer\s*<<(.*?)>>\s*startxref", re.S)
+    _SUBCONJUNTO = re.compile(rb"/(BaseFont|FontName) /([A-Z]{6})\+([^\s/<>\[\]()]+)")
+
+    def __init__(self, destino):
+        self.destino = destino
+        self._posiciones = [None]   # el objeto 0 no existe; se reserva su número
+        self._raiz = None
+        self._catalogo = None
+        self._info = None
+        self._nodos = []
+        self._paginas = 0
+        self._subconjuntos = 0
+        self._imagenes = {}
+        self._posicion = 0
+        self._hash = hashlib.md5()
+
+    def _escribir(self, datos):
+        self.destino.write(datos)
+        self._hash.update(datos)
+        self._posicion += len(datos)
+
+    def _reservar(self):
+        self._posiciones.append(None)
+        return len(self._posiciones) - 1
+
+    def _etiqueta(self):
+        """Siguiente etiqueta de subconjunto: AAAAAA, AAAAAB, ..."""
+        numero, letras = self._subconjuntos, []
+        self._subconjuntos += 1
+        for _ in range(6):
+            numero, resto = divmod(numero, 26)
+            letras.append(65 + resto)
+        return bytes(reversed(letras))
+
+    @staticmethod
+    def _partir(cuerpo):
+        # Solo el diccionario lleva referencias; el stream se copia tal cual.
+        corte = cuerpo.find(b"stream")
+        return (cuerpo, b"") if corte < 0 else (cuerpo[:corte], cuerpo[corte:])
+
+    def agregar(self, pdf):
+        inicio_xref = int(pdf[pdf.rindex(b"startxref") + len(b"startxref"):].split()[0])
+        xref = self._XREF.match(pdf, inicio_xref)
+        cantidad = int(xref.group(1))
+        desplazamientos = [int(linea[:10]) for linea in pdf[xref.end():].splitlines()[:cantidad]]
+        trailer = self._TRAILER.search(pdf, inicio_xref).group(1)
+        catalogo = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+        info = int(re.search(rb"/Info (\d+) 0 R", trailer).group(1))
+
+        if self._raiz is None:
+            # Versión y comentario binario de la primera parte.
+            self._escribir(pdf[:self._OBJETO.search(pdf).start()])
+            self._raiz = self._reservar()
+            self._catalogo = self._reservar()
+
+        # Cada objeto va desde su posición en la xref hasta la del siguiente.
+        cuerpos = {}
+        orden = sorted((d, n) for n, d in enumerate(desplazamientos) if n)
+        for (inicio, numero), (fin, _) in zip(orden, orden[1:] + [(inicio_xref, None)]):
+            cuerpos[numero] = pdf[self._OBJETO.match(pdf, inicio).end():fin]
+        paginas = int(re.search(rb"/Pages (\d+) 0 R", cuerpos[catalogo]).group(1))
+
+        descartados = {catalogo} if self._info is None else {catalogo, info}
+        nuevos, compartidos = {}, set()
+        renumerar = lambda diccionario: self._REFERENCIA.sub(lambda m: b"%d 0 R" % nuevos[int(m.group(1))], diccionario)
+
+        # Las imágenes se resuelven primero, las que no referencian a otras
+        # (la máscara) antes que las que sí, para poder comparar su huella.
+        imagenes = [n for n in sorted(cuerpos) if b"/Subtype /Image" in self._partir(cuerpos[n])[0]]
+        while imagenes:
+            pendientes = []
+            for numero in imagenes:
+                diccionario, resto = self._partir(cuerpos[numero])
+                if any(int(r) not in nuevos for r in self._REFERENCIA.findall(diccionario)):
+                    pendientes.append(numero)
+                    continue
+                huella = hashlib.sha256(renumerar(diccionario) + resto).digest()
+                if huella in self._imagenes:
+                    nuevos[numero] = self._imagenes[huella]
+                    compartidos.add(numero)
+                else:
+                    nuevos[numero] = self._imagenes[huella] = self._reservar()
+            if len(pendientes) == len(imagenes):
+                # Referencias a algo que no es imagen: se copian sin compartir.
+                nuevos.update((numero, self._reservar()) for numero in pendientes)
+                break
+            imagenes = pendientes
+
+        for numero in sorted(cuerpos):
+            if numero not in descartados and numero not in nuevos:
+                nuevos[numero] = self._reservar()
+        if self._info is None:
+            self._info = nuevos[info]
+
+        etiquetas = {}
+        def etiquetar(m):
+            if (m.group(2), m.group(3)) not in etiquetas:
+                etiquetas[m.group(2), m.group(3)] = self._etiqueta()
+            return b"/%s /%s+%s" % (m.group(1), etiquetas[m.group(2), m.group(3)], m.group(3))
+
+        for numero, destino in sorted(nuevos.items(), key=lambda par: par[1]):
+            if numero in compartidos:
+                continue
+            cuerpo = cuerpos[numero]
+            if numero != info:
+                diccionario, resto = self._partir(cuerpo)
+                diccionario = self._SUBCONJUNTO.sub(etiquetar, renumerar(diccionario))
+                if numero == paginas:
+                    self._paginas += int(re.search(rb"/Count (\d+)", diccionario).group(1))
+                    self._nodos.append(destino)
+                    diccionario = diccionario.replace(b"<<", b"<<\n/Parent %d 0 R" % self._raiz, 1)
+                cuerpo = diccionario + resto
+            self._posiciones[destino] = self._posicion
+            self._escribir(b"%d 0 obj\n" % destino + cuerpo)
+
+    def cerrar(self):
+        kids = b" ".join(b"%d 0 R" % nodo for nodo in self._nodos)
+        for numero, cuerpo in (
+            (self._raiz, b"<<\n/Count %d /Kids [ %s ] /Type /Pages\n>>\nendobj\n" % (self._paginas, kids)),
+            (self._catalogo, b"<<\n/PageMode /UseNone /Pages %d 0 R /Type /Catalog\n>>\nendobj\n" % self._raiz),
+        ):
+            self._posiciones[numero] = self._posicion
+            self._escribir(b"%d 0 obj\n" % numero + cuerpo)
+
+        inicio_xref = self._posicion
+        tabla = [b"xref\n0 %d\n0000000000 65535 f \n" % len(self._posiciones)]
+        tabla.extend(b"%010d 00000 n \n" % posicion for posicion in self._posiciones[1:])
+        identificador = self._hash.hexdigest().encode()
+        tabla.append(
+            b"trailer\n<<\n/ID \n[<%s><%s>]\n/Info %d 0 R\n/Root %d 0 R\n/Size %d\n>>\nstartxref\n%d\n%%%%EOF\n"
+            % (identificador, identificador, self._info, self._catalogo, len(self._posiciones), inicio_xref)
+        )
+        self.destino.write(b"".join(tabla))
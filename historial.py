@@ -0,0 +1,235 @@
+# historial.py
+"""
+Registro de comprobantes generados para los reportes de cierre.
+
+FACTURAS_DB debe apuntar a un disco persistente y compartido por todos los
+workers: el 'facturas.db' predeterminado queda en el directorio de trabajo, y
+en Heroku ese disco es propio de cada dyno y se borra en cada reinicio, con lo
+que se pierden el historial y la numeración.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DB_PATH = os.environ.get("FACTURAS_DB", "facturas.db")
+TIENDA_PREDETERMINADA = "principal"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS facturas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    creada TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    plantilla TEXT NOT NULL,
+    cliente TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    total REAL NOT NULL,
+    pago_parcial REAL NOT NULL DEFAULT 0,
+    productos TEXT NOT NULL,
+    tienda TEXT NOT NULL DEFAULT 'principal',
+    numero INTEGER,
+    id_local TEXT
+);
+"""
+
+# Columnas agregadas después de la primera versión del esquema.
+_MIGRACIONES = {
+    "tienda": "ALTER TABLE facturas ADD COLUMN tienda TEXT NOT NULL DEFAULT 'principal'",
+    "numero": "ALTER TABLE facturas ADD COLUMN numero INTEGER",
+    "id_local": "ALTER TABLE facturas ADD COLUMN id_local TEXT",
+}
+
+_INDICES = """
+CREATE INDEX IF NOT EXISTS idx_facturas_tienda_fecha ON facturas (tienda, fecha, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_facturas_tienda_numero ON facturas (tienda, numero);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_facturas_tienda_id_local ON facturas (tienda, id_local);
+"""
+
+_local = threading.local()
+
+
+def _conexion(db_path=None):
+    """Devuelve una conexión por hilo (sqlite3 no comparte conexiones entre hilos)."""
+    path = db_path or DB_PATH
+    conexiones = getattr(_local, "conexiones", None)
+    if conexiones is None:
+        conexiones = _local.conexiones = {}
+    conn = conexiones.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(_ESQUEMA)
+        columnas = {fila["name"] for fila in conn.execute("PRAGMA table_info(facturas)")}
+        for columna, sql in _MIGRACIONES.items():
+            if columna not in columnas:
+                conn.execute(sql)
+        conn.executescript(_INDICES)
+        conexiones[path] = conn
+    return conn
+
+
+def _fecha_iso(fecha):
+    """Convierte 'dd/mm/aaaa' al formato ISO que permite filtrar por rango."""
+    return datetime.strptime(fecha, "%d/%m/%Y").strftime("%Y-%m-%d")
+
+
+def registrar(cliente, estado, fecha, productos, plantilla="A", pago_parcial=0.0,
+              tienda=TIENDA_PREDETERMINADA, db_path=None, id_local=None):
+    """
+    Guarda los datos de un comprobante y devuelve su número correlativo dentro de la tienda.
+
+    'id_local' es el identificador que el navegador asigna a cada venta. Si ya
+    está registrado, la fila existente se actualiza con estos datos y conserva
+    su número: reemitir el comprobante (otro estado, un abono) o reintentar la
+    cola sin conexión no cuenta la venta dos veces. Sin 'id_local' cada llamada
+    es una venta nueva, aunque sus datos coincidan con otra.
+    """
+    numero, nuevo = reservar(
+        cliente, estado, fecha, productos, plantilla=plantilla, pago_parcial=pago_parcial,
+        tienda=tienda, db_path=db_path, id_local=id_local,
+    )
+    if not nuevo:
+        _actualizar(_conexion(db_path), numero, cliente, estado, fecha, productos, plantilla, pago_parcial, tienda)
+    return numero
+
+
+def reservar(cliente, estado, fecha, productos, plantilla="A", pago_parcial=0.0,
+             tienda=TIENDA_PREDETERMINADA, db_path=None, id_local=None):
+    """
+    Como 'registrar', pero devuelve (numero, nuevo) y no toca una venta que ya
+    estaba registrada ('nuevo' falso): sus datos se actualizan con 'registrar'
+    una vez generado el comprobante. Una fila nueva se puede deshacer con
+    'descartar' si el comprobante finalmente no se genera.
+    """
+    total = sum(p[3] for p in productos)
+    conn = _conexion(db_path)
+    try:
+        numero = _insertar(conn, cliente, estado, fecha, productos, plantilla, pago_parcial, tienda, id_local, total)
+        return numero, True
+    except sqlite3.IntegrityError:
+        if id_local is None:
+            raise
+        fila = conn.execute(
+            "SELECT numero FROM facturas WHERE tienda = ? AND id_local = ?", (tienda, id_local)
+        ).fetchone()
+        if fila is None:
+            raise
+        return fila["numero"], False
+
+
+def descartar(numero, tienda=TIENDA_PREDETERMINADA, db_path=None):
+    """Borra un comprobante reservado cuyo render falló, para que no aparezca en los reportes."""
+    conn = _conexion(db_path)
+    with conn:
+        conn.execute("DELETE FROM facturas WHERE tienda = ? AND numero = ?", (tienda, numero))
+
+
+def _insertar(conn, cliente, estado, fecha, productos, plantilla, pago_parcial, tienda, id_local, total):
+    with conn:
+        # El correlativo se calcula en la misma sentencia: SQLite la ejecuta con
+        # el bloqueo de escritura tomado, así dos workers no repiten número.
+        cur = conn.execute(
+            "INSERT INTO facturas"
+            " (creada, fecha, plantilla, cliente, estado, total, pago_parcial, productos, tienda, numero, id_local)"
+            " SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(MAX(numero), 0) + 1, ?"
+            " FROM facturas WHERE tienda = ?",
+            (
+                datetime.now().isoformat(timespec="seconds"),
+                _fecha_iso(fecha),
+                plantilla,
+                cliente,
+                estado,
+                total,
+                pago_parcial or 0.0,
+                json.dumps(productos, ensure_ascii=False),
+                tienda,
+                id_local,
+                tienda,
+            ),
+        )
+        (numero,) = conn.execute("SELECT numero FROM facturas WHERE id = ?", (cur.lastrowid,)).fetchone()
+    return numero
+
+
+def _actualizar(conn, numero, cliente, estado, fecha, productos, plantilla, pago_parcial, tienda):
+    with conn:
+        conn.execute(
+            "UPDATE facturas SET fecha = ?, plantilla = ?, cliente = ?, estado = ?, total = ?,"
+            " pago_parcial = ?, productos = ? WHERE tienda = ? AND numero = ?",
+            (
+                _fecha_iso(fecha),
+                plantilla,
+                cliente,
+                estado,
+                sum(p[3] for p in productos),
+                pago_parcial or 0.0,
+                json.dumps(productos, ensure_ascii=False),
+                tienda,
+                numero,
+            ),
+        )
+
+
+def iterar_facturas(desde, hasta, plantilla=None, tienda=TIENDA_PREDETERMINADA, db_path=None):
+    """
+    Recorre los comprobantes de la tienda entre 'desde' y 'hasta' (ISO, inclusive)
+    en orden. Se lee fila por fila del cursor para no cargar el rango completo en memoria.
+    """
+    sql = "SELECT * FROM facturas WHERE tienda = ? AND fecha BETWEEN ? AND ?"
+    params = [tienda, desde, hasta]
+    if plantilla:
+        sql += " AND plantilla = ?"
+        params.append(plantilla)
+    sql += " ORDER BY fecha, id"
+    for fila in _conexion(db_path).execute(sql, params):
+        yield {
+            "id": fila["id"],
+            "numero": fila["numero"],
+            "fecha": datetime.strptime(fila["fecha"], "%Y-%m-%d").strftime("%d/%m/%Y"),
+            "plantilla": fila["plantilla"],
+            "cliente": fila["cliente"],
+            "estado": fila["estado"],
+            "total": fila["total"],
+            "pago_parcial": fila["pago_parcial"],
+            "productos": json.loads(fila["productos"]),
+        }
+
+
+def resumen(desde, hasta, plantilla=None, tienda=TIENDA_PREDETERMINADA, db_path=None):
+    """Totales agregados por estado y por cliente, calculados en la base de datos."""
+    filtro = "WHERE tienda = ? AND fecha BETWEEN ? AND ?"
+    params = [tienda, desde, hasta]
+    if plantilla:
+        filtro += " AND plantilla = ?"
+        params.append(plantilla)
+
+    conn = _conexion(db_path)
+    saldo = "SUM(CASE WHEN pago_parcial > 0 THEN MAX(total - pago_parcial, 0) ELSE 0 END)"
+    general = conn.execute(
+        f"SELECT COUNT(*) AS cantidad, COALESCE(SUM(total), 0) AS total,"
+        f" COALESCE(SUM(pago_parcial), 0) AS abonado, COALESCE({saldo}, 0) AS saldo,"
+        f" COALESCE(SUM(json_array_length(productos)), 0) AS productos"
+        f" FROM facturas {filtro}",
+        params,
+    ).fetchone()
+    por_estado = conn.execute(
+        f"SELECT estado, COUNT(*) AS cantidad, SUM(total) AS total, {saldo} AS saldo"
+        f" FROM facturas {filtro} GROUP BY estado ORDER BY estado",
+        params,
+    ).fetchall()
+    por_cliente = conn.execute(
+        f"SELECT cliente, COUNT(*) AS cantidad, SUM(total) AS total, {saldo} AS saldo"
+        f" FROM facturas {filtro} GROUP BY cliente ORDER BY total DESC, cliente",
+        params,
+    ).fetchall()
+    return {
+        "cantidad": general["cantidad"],
+        "total": general["total"],
+        "abonado": general["abonado"],
+        "saldo": general["saldo"],
+        # Filas de producto del rango, para estimar el tamaño del reporte antes de generarlo.
+        "productos": general["productos"],
+        "por_estado": [dict(f) for f in por_estado],
+        "por_cliente": [dict(f) for f in por_cliente],
+    }
@@ -0,0 +1,230 @@
+# limites.py
+"""Control de admisión: límite de peticiones por IP y de renders simultáneos."""
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class Rechazo(Exception):
+    """La petición no se admite; 'status' y 'retry_after' van a la respuesta HTTP."""
+
+    def __init__(self, mensaje, status, retry_after):
+        super().__init__(mensaje)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class MemoriaStore:
+    """Contadores en el proceso; cada worker de gunicorn aplica sus propios límites."""
+
+    MAX_CLAVES = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cubetas = {}
+        self._slots = {}
+
+    def tomar_token(self, clave, tasa, capacidad):
+        """Devuelve (admitido, segundos hasta el próximo token)."""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, actualizado, _ = self._cubetas.get(clave, (capacidad, ahora, ahora))
+            tokens = min(capacidad, tokens + (ahora - actualizado) * tasa)
+            admitido = tokens >= 1
+            if admitido:
+                tokens -= 1
+            self._cubetas[clave] = (tokens, ahora, ahora + (capacidad - tokens) / tasa)
+            if len(self._cubetas) > self.MAX_CLAVES:
+                self._purgar(ahora)
+        return admitido, 0.0 if admitido else (1 - tokens) / tasa
+
+    def _purgar(self, ahora):
+        # Una cubeta que ya se rellenó por completo equivale a no tener registro.
+        # Cada cubeta guarda cuándo se llena con su propia tasa: un limitador no
+        # debe borrar las de otro espacio más lento.
+        llenas = [clave for clave, (_, _, lleno) in self._cubetas.items() if lleno <= ahora]
+        for clave in llenas:
+            del self._cubetas[clave]
+
+    def adquirir_slot(self, limite, grupo=""):
+        with self._lock:
+            slots = self._slots.setdefault(grupo, set())
+            if len(slots) >= limite:
+                return None
+            token = uuid.uuid4().hex
+            slots.add(token)
+            return token
+
+    def liberar_slot(self, token, grupo=""):
+        with self._lock:
+            self._slots.get(grupo, set()).discard(token)
+
+    def slots_en_uso(self, grupo=""):
+        with self._lock:
+            return len(self._slots.get(grupo, ()))
+
+    def renovar_slot(self, token, grupo=""):
+        # Los slots en el proceso no expiran: se liberan al salir del bloque.
+        pass
+
+
+class SQLiteStore:
+    """
+    Contadores compartidos entre workers a través de un archivo SQLite local.
+    Los slots expiran tras 'ttl_slot' segundos por si un worker muere sin liberarlos;
+    un render largo los mantiene con 'renovar_slot'.
+    """
+
+    _ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS cubetas (
+        clave TEXT PRIMARY KEY, tokens REAL NOT NULL, actualizado REAL NOT NULL, lleno REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS slots (token TEXT PRIMARY KEY, expira REAL NOT NULL, grupo TEXT NOT NULL DEFAULT '');
+    """
+
+    def __init__(self, path, ttl_slot=60.0):
+        self.path = path
+        self.ttl_slot = ttl_slot
+        self._local = threading.local()
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self._ESQUEMA)
+            columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(slots)")}
+            if "grupo" not in columnas:
+                conn.execute("ALTER TABLE slots ADD COLUMN grupo TEXT NOT NULL DEFAULT ''")
+            columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(cubetas)")}
+            if "lleno" not in columnas:
+                conn.execute("ALTER TABLE cubetas ADD COLUMN lleno REAL NOT NULL DEFAULT 0")
+            conn.execute("DROP INDEX IF EXISTS idx_cubetas_actualizado")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cubetas_lleno ON cubetas (lleno)")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaccion(self):
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def tomar_token(self, clave, tasa, capacidad):
+        ahora = time.time()
+        with self._transaccion() as conn:
+            fila = conn.execute(
+                "SELECT tokens, actualizado FROM cubetas WHERE clave = ?", (clave,)
+            ).fetchone()
+            tokens, actualizado = fila if fila else (capacidad, ahora)
+            tokens = min(capacidad, tokens + max(ahora - actualizado, 0) * tasa)
+            admitido = tokens >= 1
+            if admitido:
+                tokens -= 1
+            conn.execute(
+                "INSERT OR REPLACE INTO cubetas (clave, tokens, actualizado, lleno) VALUES (?, ?, ?, ?)",
+                (clave, tokens, ahora, ahora + (capacidad - tokens) / tasa),
+            )
+            # Se purga por el momento en que cada cubeta se llena con su propia tasa,
+            # no con la de quien llama: las tiendas comparten la tabla.
+            conn.execute("DELETE FROM cubetas WHERE lleno < ?", (ahora,))
+        return admitido, 0.0 if admitido else (1 - tokens) / tasa
+
+    def adquirir_slot(self, limite, grupo=""):
+        ahora = time.time()
+        with self._transaccion() as conn:
+            conn.execute("DELETE FROM slots WHERE expira < ?", (ahora,))
+            (en_uso,) = conn.execute("SELECT COUNT(*) FROM slots WHERE grupo = ?", (grupo,)).fetchone()
+            if en_uso >= limite:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO slots (token, expira, grupo) VALUES (?, ?, ?)",
+                (token, ahora + self.ttl_slot, grupo),
+            )
+            return token
+
+    def liberar_slot(self, token, grupo=""):
+        with self._transaccion() as conn:
+            conn.execute("DELETE FROM slots WHERE token = ?", (token,))
+
+    def renovar_slot(self, token, grupo=""):
+        with self._transaccion() as conn:
+            conn.execute(
+                "UPDATE slots SET expira = ? WHERE token = ?", (time.time() + self.ttl_slot, token)
+            )
+
+    def slots_en_uso(self, grupo=""):
+        (en_uso,) = self._conexion().execute(
+            "SELECT COUNT(*) FROM slots WHERE grupo = ? AND expira >= ?", (grupo, time.time())
+        ).fetchone()
+        return en_uso
+
+
+class Limitador:
+    """
+    Cubeta de tokens por cliente ('tasa' peticiones/s con ráfagas de 'rafaga')
+    y un tope global de renders simultáneos. Lo que no cabe se rechaza de
+    inmediato en lugar de quedar encolado.
+
+    'espacio' separa cubetas y slots de varios limitadores sobre el mismo
+    store (por ejemplo, la cuota de cada tienda).
+    """
+
+    def __init__(self, store=None, tasa=1.0, rafaga=5, max_renders=2, espera_ocupado=2, espacio=""):
+        self.store = store or MemoriaStore()
+        self.espacio = espacio
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.max_renders = max_renders
+        self.espera_ocupado = espera_ocupado
+        self._lock = threading.Lock()
+        self._contadores = {"admitidas": 0, "rechazadas_tasa": 0, "rechazadas_ocupado": 0}
+
+    def admitir(self, clave):
+        if self.espacio:
+            clave = f"{self.espacio}:{clave}"
+        admitido, espera = self.store.tomar_token(clave, self.tasa, self.rafaga)
+        if not admitido:
+            self._contar("rechazadas_tasa")
+            raise Rechazo(
+                "Demasiadas solicitudes; espera un momento antes de reintentar.",
+                429,
+                max(1, math.ceil(espera)),
+            )
+        self._contar("admitidas")
+
+    @contextmanager
+    def slot_render(self):
+        """Ocupa un slot de render; entrega una función que lo renueva en renders largos."""
+        token = self.store.adquirir_slot(self.max_renders, self.espacio)
+        if token is None:
+            self._contar("rechazadas_ocupado")
+            raise Rechazo(
+                "El servidor está ocupado generando otros comprobantes; intenta de nuevo.",
+                503,
+                self.espera_ocupado,
+            )
+        try:
+            yield lambda: self.store.renovar_slot(token, self.espacio)
+        finally:
+            self.store.liberar_slot(token, self.espacio)
+
+    def _contar(self, nombre):
+        with self._lock:
+            self._contadores[nombre] += 1
+
+    def metricas(self):
+        with self._lock:
+            datos = dict(self._contadores)
+        datos["renders_en_curso"] = self.store.slots_en_uso(self.espacio)
+        datos["max_renders"] = self.max_renders
+        return datos
@@ -0,0 +1,82 @@
+# memoria.py
+"""Presupuesto de memoria por petición: techo previo al render y medición del pico por muestreo."""
+import random
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from limites import Rechazo
+
+
+class ControlMemoria:
+    """
+    'admitir' rechaza con 413, antes de renderizar, los trabajos cuya memoria
+    estimada supera 'techo' bytes (None desactiva el techo).
+
+    'medir' envuelve un render y, en 1 de cada 'muestreo' peticiones, registra
+    con tracemalloc el pico de memoria asignada durante el bloque. tracemalloc
+    es global al proceso: se mide una petición a la vez y, con varios hilos por
+    worker, el pico también incluye lo que asignen los demás. Los píxeles de
+    PIL se reservan fuera del asignador de Python y no aparecen en el pico.
+    """
+
+    def __init__(self, techo=None, muestreo=0):
+        self.techo = techo
+        self.muestreo = muestreo
+        self._lock = threading.Lock()
+        self._midiendo = threading.Lock()
+        self._contadores = {"rechazadas": 0, "mediciones": 0}
+        self._pico_max = 0
+        self._ultima = None
+
+    def admitir(self, estimado, mensaje):
+        if self.techo is not None and estimado > self.techo:
+            with self._lock:
+                self._contadores["rechazadas"] += 1
+            raise Rechazo(mensaje, 413, None)
+
+    def _toca_medir(self):
+        return self.muestreo > 0 and random.randrange(self.muestreo) == 0
+
+    @contextmanager
+    def medir(self, nombre, estimado=None):
+        if not self._toca_medir() or not self._midiendo.acquire(blocking=False):
+            yield
+            return
+
+        # Si el proceso ya traza (PYTHONTRACEMALLOC), se reutiliza sin detenerlo al final.
+        propio = not tracemalloc.is_tracing()
+        try:
+            if propio:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+            inicial = tracemalloc.get_traced_memory()[0]
+            yield
+            pico = tracemalloc.get_traced_memory()[1] - inicial
+        finally:
+            if propio:
+                tracemalloc.stop()
+            self._midiendo.release()
+        self._registrar(nombre, pico, estimado)
+
+    def _registrar(self, nombre, pico, estimado):
+        medicion = {"nombre": nombre, "pico": pico, "estimado": estimado}
+        with self._lock:
+            self._contadores["mediciones"] += 1
+            self._pico_max = max(self._pico_max, pico)
+            self._ultima = medicion
+        print(
+            f"[memoria] {nombre}: pico {pico / 1024:.0f} KB"
+            + (f" (estimado {estimado / 1024:.0f} KB)" if estimado else ""),
+            flush=True,
+        )
+
+    def metricas(self):
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["pico_max"] = self._pico_max
+            datos["ultima"] = dict(self._ultima) if self._ultima else None
+        datos["techo"] = self.techo
+        datos["muestreo"] = self.muestreo
+        return datos
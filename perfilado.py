@@ -0,0 +1,168 @@
+# perfilado.py
+"""Perfilado bajo demanda de peticiones lentas (cProfile o muestreo de pilas)."""
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+
+from flask import make_response, request
+
+
+class Perfilador:
+    """
+    Ejecuta una vista bajo un perfilador cuando la petición trae el secreto
+    (cabecera X-Perfil o parámetro ?perfil=) o cuando cae en el muestreo
+    automático de 1 de cada 'muestreo' peticiones.
+
+    Los perfiles se guardan en 'directorio' con un tope de archivos y de
+    bytes; al superarlo se borran los más antiguos.
+    """
+
+    MODOS = ("muestreo", "cprofile")
+
+    def __init__(self, secreto=None, directorio="/tmp/perfiles", muestreo=0,
+                 max_archivos=50, max_bytes=50 * 1024 * 1024, intervalo=0.005):
+        self.secreto = secreto or None
+        self.directorio = directorio
+        self.muestreo = muestreo
+        self.max_archivos = max_archivos
+        self.max_bytes = max_bytes
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+
+    @property
+    def activo(self):
+        return bool(self.secreto) or self.muestreo > 0
+
+    def autorizado(self, valor):
+        return bool(self.secreto) and bool(valor) and hmac.compare_digest(str(valor), self.secreto)
+
+    def _solicitado(self):
+        valor = request.headers.get("X-Perfil") or request.args.get("perfil")
+        if self.autorizado(valor):
+            modo = request.args.get("perfil_modo") or request.headers.get("X-Perfil-Modo")
+            return modo if modo in self.MODOS else "muestreo"
+        if self.muestreo > 0 and random.randrange(self.muestreo) == 0:
+            return "muestreo"
+        return None
+
+    def perfilable(self, vista):
+        """Decorador para las vistas que se pueden perfilar."""
+
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            modo = self._solicitado() if self.activo else None
+            if modo is None:
+                return vista(*args, **kwargs)
+
+            inicio = time.perf_counter()
+            if modo == "cprofile":
+                perfil = cProfile.Profile()
+                respuesta = perfil.runcall(vista, *args, **kwargs)
+                duracion = time.perf_counter() - inicio
+                nombre = self._guardar(vista.__name__, duracion, "prof", perfil.dump_stats)
+            else:
+                muestras = _Muestreador(threading.get_ident(), self.intervalo)
+                muestras.start()
+                try:
+                    respuesta = vista(*args, **kwargs)
+                finally:
+                    muestras.detener()
+                duracion = time.perf_counter() - inicio
+                nombre = self._guardar(vista.__name__, duracion, "txt", muestras.escribir)
+
+            respuesta = make_response(respuesta)
+            if nombre:
+                respuesta.headers["X-Perfil-Archivo"] = nombre
+            return respuesta
+
+        return envoltura
+
+    def _guardar(self, vista, duracion, extension, escribir):
+        nombre = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}_{vista}_{int(duracion * 1000)}ms"
+            f"_{uuid.uuid4().hex[:8]}.{extension}"
+        )
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            escribir(os.path.join(self.directorio, nombre))
+            self._recortar()
+        except OSError as exc:
+            print(f"[perfil] No se pudo guardar el perfil: {exc}", flush=True)
+            return None
+        return nombre
+
+    def _recortar(self):
+        """Mantiene el directorio dentro de los topes borrando los perfiles más antiguos."""
+        with self._lock:
+            archivos = sorted(self.listar(), key=lambda a: a["modificado"])
+            total = sum(a["bytes"] for a in archivos)
+            while archivos and (len(archivos) > self.max_archivos or total > self.max_bytes):
+                viejo = archivos.pop(0)
+                total -= viejo["bytes"]
+                try:
+                    os.unlink(os.path.join(self.directorio, viejo["nombre"]))
+                except OSError:
+                    pass
+
+    def listar(self):
+        try:
+            entradas = list(os.scandir(self.directorio))
+        except OSError:
+            return []
+        archivos = []
+        for entrada in entradas:
+            if not entrada.name.endswith((".prof", ".txt")):
+                continue
+            try:
+                info = entrada.stat()
+            except OSError:
+                continue
+            archivos.append({"nombre": entrada.name, "bytes": info.st_size, "modificado": info.st_mtime})
+        return archivos
+
+    def ruta(self, nombre):
+        """Ruta de un perfil guardado, o None si el nombre no corresponde a uno."""
+        if os.path.basename(nombre) != nombre:
+            return None
+        if not any(a["nombre"] == nombre for a in self.listar()):
+            return None
+        return os.path.join(self.directorio, nombre)
+
+
+class _Muestreador(threading.Thread):
+    """Toma la pila del hilo indicado cada 'intervalo' segundos (formato collapsed stack)."""
+
+    def __init__(self, hilo, intervalo):
+        super().__init__(daemon=True)
+        self.hilo = hilo
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self._fin = threading.Event()
+
+    def run(self):
+        while not self._fin.wait(self.intervalo):
+            frame = sys._current_frames().get(self.hilo)
+            pila = []
+            while frame is not None:
+                codigo = frame.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                frame = frame.f_back
+            if pila:
+                self.pilas[";".join(reversed(pila))] += 1
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+    def escribir(self, ruta):
+        # Formato de flamegraph.pl / speedscope: "marco;marco;marco cuenta" por línea.
+        with open(ruta, "w", encoding="utf-8") as f:
+            for pila, cuenta in self.pilas.most_common():
+                f.write(f"{pila} {cuenta}\n")
@@ -0,0 +1,469 @@
+// render_local.js
+// Genera el comprobante en el navegador a partir de /layout.json, con las mismas
+// posiciones, textos y saltos de página que generar_factura.py. Se usa cuando
+// el servidor no responde; el pedido se registra después en /pedidos.
+(function (global) {
+  'use strict';
+
+  // Versión de layout_spec() que este archivo sabe dibujar (LAYOUT_VERSION).
+  const VERSION_LAYOUT = 1;
+  const NEGRO = '#000000';
+  const ROLES_FUENTE = ['regular', 'bold', 'italic'];
+  const LADO_LOGO = 240;  // px del logo re-codificado en JPEG (3x de 80 pt)
+
+  // Códigos WinAnsi (cp1252) de 0x80-0x9F; el resto coincide con Latin-1.
+  const WINANSI = {
+    0x20AC: 0x80, 0x201A: 0x82, 0x0192: 0x83, 0x201E: 0x84, 0x2026: 0x85, 0x2020: 0x86,
+    0x2021: 0x87, 0x02C6: 0x88, 0x2030: 0x89, 0x0160: 0x8A, 0x2039: 0x8B, 0x0152: 0x8C,
+    0x017D: 0x8E, 0x2018: 0x91, 0x2019: 0x92, 0x201C: 0x93, 0x201D: 0x94, 0x2022: 0x95,
+    0x2013: 0x96, 0x2014: 0x97, 0x02DC: 0x98, 0x2122: 0x99, 0x0161: 0x9A, 0x203A: 0x9B,
+    0x0153: 0x9C, 0x017E: 0x9E, 0x0178: 0x9F
+  };
+
+  function codigoWinAnsi(caracter) {
+    const cp = caracter.codePointAt(0);
+    if ((cp >= 0x20 && cp < 0x7F) || (cp >= 0xA0 && cp <= 0xFF)) return cp;
+    return WINANSI[cp] || 0x3F;  // '?' para lo que no existe en la codificación
+  }
+
+  // ---------- Formato de números como en Python ----------
+
+  // toFixed(2) redondea los empates hacia arriba y Python al par; en binario
+  // solo hay empate exacto en los múltiplos impares de 1/8.
+  function fijo2(valor) {
+    if (Number.isInteger(valor * 8) && !Number.isInteger(valor * 4)) {
+      const centavos = Math.floor(valor * 100);
+      const par = centavos % 2 === 0 ? centavos : centavos + 1;
+      return (par / 100).toFixed(2);
+    }
+    return valor.toFixed(2);
+  }
+
+  // f"{valor:,.2f}"
+  function miles(valor) {
+    const [entero, decimales] = fijo2(valor).split('.');
+    const signo = entero.startsWith('-') ? '-' : '';
+    const digitos = signo ? entero.slice(1) : entero;
+    return signo + digitos.replace(/\B(?=(\d{3})+(?!\d))/g, ',') + '.' + decimales;
+  }
+
+  function num(valor) {
+    return String(Number(valor.toFixed(3)));
+  }
+
+  function colorPdf(hex) {
+    const valor = hex.replace('#', '');
+    return [0, 2, 4].map(i => num(parseInt(valor.slice(i, i + 2), 16) / 255)).join(' ');
+  }
+
+  // ---------- Canvas mínimo con la semántica de ReportLab ----------
+
+  class Lienzo {
+    constructor(spec) {
+      this.spec = spec;
+      this.paginas = [];
+      this.codigo = [];
+      this.imagenes = [];
+      this.pila = [];
+      this._estadoInicial();
+    }
+
+    // Igual que Canvas.init_graphics_state(): cada página empieza en Helvetica 12, negro, grosor 1.
+    _estadoInicial() {
+      this.estado = { fuente: 'regular', tamano: 12, relleno: NEGRO, trazo: NEGRO, grosor: 1 };
+    }
+
+    setFont(rol, tamano) { this.estado.fuente = rol; this.estado.tamano = tamano; }
+    setFillColor(hex) { this.estado.relleno = hex; }
+    setStrokeColor(hex) { this.estado.trazo = hex; }
+    setLineWidth(grosor) { this.estado.grosor = grosor; }
+    saveState() { this.pila.push(Object.assign({}, this.estado)); }
+    restoreState() { this.estado = this.pila.pop(); }
+
+    stringWidth(texto, rol, tamano) {
+      const anchos = this.spec.fuentes[rol].anchos;
+      let total = 0;
+      for (const caracter of texto) {
+        total += anchos[codigoWinAnsi(caracter) - 32] || 0;
+      }
+      return total * tamano / 1000;
+    }
+
+    drawString(x, y, texto) {
+      let bytes = '';
+      for (const caracter of texto) {
+        const codigo = codigoWinAnsi(caracter);
+        const byte = String.fromCharCode(codigo);
+        bytes += (byte === '(' || byte === ')' || byte === '\\') ? '\\' + byte : byte;
+      }
+      const fuente = ROLES_FUENTE.indexOf(this.estado.fuente) + 1;
+      this.codigo.push(
+        `${colorPdf(this.estado.relleno)} rg BT /F${fuente} ${num(this.estado.tamano)} Tf ` +
+        `${num(x)} ${num(y)} Td (${bytes}) Tj ET`
+      );
+    }
+
+    drawRightString(x, y, texto) {
+      this.drawString(x - this.stringWidth(texto, this.estado.fuente, this.estado.tamano), y, texto);
+    }
+
+    drawCentredString(x, y, texto) {
+      this.drawString(x - this.stringWidth(texto, this.estado.fuente, this.estado.tamano) / 2, y, texto);
+    }
+
+    _trazo() {
+      return `${colorPdf(this.estado.trazo)} RG ${num(this.estado.grosor)} w`;
+    }
+
+    line(x1, y1, x2, y2) {
+      this.codigo.push(`${this._trazo()} ${num(x1)} ${num(y1)} m ${num(x2)} ${num(y2)} l S`);
+    }
+
+    rect(x, y, ancho, alto) {
+      this.codigo.push(`${this._trazo()} ${num(x)} ${num(y)} ${num(ancho)} ${num(alto)} re S`);
+    }
+
+    drawImage(imagen, x, y, ancho, alto) {
+      let indice = this.imagenes.indexOf(imagen);
+      if (indice < 0) indice = this.imagenes.push(imagen) - 1;
+      this.codigo.push(`q ${num(ancho)} 0 0 ${num(alto)} ${num(x)} ${num(y)} cm /Im${indice + 1} Do Q`);
+    }
+
+    showPage() {
+      this.paginas.push(this.codigo.join('\n'));
+      this.codigo = [];
+      this._estadoInicial();
+    }
+
+    // Documento PDF como cadena binaria (un carácter por byte).
+    save(info) {
+      if (this.codigo.length || !this.paginas.length) this.showPage();
+
+      const objetos = [];
+      const agregar = (contenido) => objetos.push(contenido);
+      const corriente = (diccionario, datos) =>
+        `<< ${diccionario} /Length ${datos.length} >>\nstream\n${datos}\nendstream`;
+
+      agregar('<< /Type /Catalog /Pages 2 0 R >>');
+      agregar(null);  // Pages, cuando se conozcan los hijos
+      const fuentes = ROLES_FUENTE.map((rol, i) => {
+        agregar(`<< /Type /Font /Subtype /Type1 /BaseFont /${this.spec.fuentes[rol].nombre}` +
+                ' /Encoding /WinAnsiEncoding >>');
+        return `/F${i + 1} ${objetos.length} 0 R`;
+      });
+      const imagenes = this.imagenes.map((imagen, i) => {
+        agregar(corriente(
+          `/Type /XObject /Subtype /Image /Width ${imagen.ancho} /Height ${imagen.alto}` +
+          ' /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode',
+          imagen.datos
+        ));
+        return `/Im${i + 1} ${objetos.length} 0 R`;
+      });
+      const recursos = `<< /Font << ${fuentes.join(' ')} >> /XObject << ${imagenes.join(' ')} >> >>`;
+      const [ancho, alto] = this.spec.pagina;
+      const hijos = this.paginas.map(pagina => {
+        agregar(corriente('', pagina));
+        agregar(`<< /Type /Page /Parent 2 0 R /MediaBox [0 0 ${num(ancho)} ${num(alto)}]` +
+                ` /Resources ${recursos} /Contents ${objetos.length} 0 R >>`);
+        return `${objetos.length} 0 R`;
+      });
+      objetos[1] = `<< /Type /Pages /Kids [${hijos.join(' ')}] /Count ${hijos.length} >>`;
+      const textoPdf = (texto) => '(' + Array.from(texto, c => String.fromCharCode(codigoWinAnsi(c)))
+        .join('').replace(/([()\\])/g, '\\$1') + ')';
+      agregar(`<< /Title ${textoPdf(info.titulo)} /Author ${textoPdf(info.autor)} /Creator (render_local) >>`);
+
+      let pdf = '%PDF-1.4\n%\xE2\xE3\xCF\xD3\n';
+      const posiciones = objetos.map((objeto, i) => {
+        const posicion = pdf.length;
+        pdf += `${i + 1} 0 obj\n${objeto}\nendobj\n`;
+        return posicion;
+      });
+      const inicioXref = pdf.length;
+      pdf += `xref\n0 ${objetos.length + 1}\n0000000000 65535 f \n`;
+      pdf += posiciones.map(p => String(p).padStart(10, '0') + ' 00000 n \n').join('');
+      pdf += `trailer\n<< /Size ${objetos.length + 1} /Root 1 0 R /Info ${objetos.length} 0 R >>\n`;
+      pdf += `startxref\n${inicioXref}\n%%EOF\n`;
+      return pdf;
+    }
+  }
+
+  // ---------- Dibujo: mismo orden que generar_factura._dibujar_factura ----------
+
+  function cap(texto) {
+    return texto ? texto.charAt(0).toUpperCase() + texto.slice(1) : texto;
+  }
+
+  // reportlab.lib.utils.simpleSplit
+  function simpleSplit(c, texto, rol, tamano, ancho) {
+    const lineas = [];
+    for (const parrafo of texto.split('\n')) {
+      const espacio = c.stringWidth(' ', rol, tamano);
+      let actual = [];
+      let w = -espacio;
+      for (const palabra of parrafo.split(/\s+/).filter(Boolean)) {
+        const lw = c.stringWidth(palabra, rol, tamano);
+        if (w + espacio + lw <= ancho || !actual.length) {
+          actual.push(palabra);
+          w += espacio + lw;
+        } else {
+          lineas.push(actual.join(' '));
+          actual = [palabra];
+          w = lw;
+        }
+      }
+      if (actual.length) lineas.push(actual.join(' '));
+    }
+    return lineas;
+  }
+
+  function drawWrapped(c, texto, x, y, ancho, rol, tamano, interlineado) {
+    if (!texto) return y;
+    c.setFont(rol, tamano);
+    c.setFillColor(NEGRO);
+    const lineas = simpleSplit(c, texto, rol, tamano, ancho);
+    lineas.forEach((linea, i) => c.drawString(x, y - i * interlineado, linea));
+    return y - interlineado * lineas.length;
+  }
+
+  function logo(c, caja, imagen) {
+    if (imagen) {
+      c.drawImage(imagen, caja.x, caja.y, caja.w, caja.h);
+      return;
+    }
+    c.saveState();
+    c.setStrokeColor('#ffffff');
+    c.setLineWidth(1);
+    c.rect(caja.x, caja.y, caja.w, caja.h);
+    c.setFont('regular', 8);
+    c.drawCentredString(caja.x + caja.w / 2, caja.y + caja.h / 2 - 4, 'LOGO');
+    c.restoreState();
+  }
+
+  function encabezado(c, L, tema, imagenLogo) {
+    logo(c, L.logo, imagenLogo);
+
+    c.setFont('bold', L.titulo.size);
+    c.setFillColor(tema.colores.primary);
+    c.drawString(L.titulo.x, L.titulo.y, tema.titulo);
+
+    const k = L.contacto;
+    let y = k.y;
+    c.setFillColor(NEGRO);
+    const direccion = `Dirección: ${tema.direccion}`;
+    if (c.stringWidth(direccion, 'regular', k.size) > k.ancho) {
+      y = drawWrapped(c, direccion, k.x, y, k.ancho, 'regular', k.size_largo, k.leading_largo);
+    } else {
+      y = drawWrapped(c, direccion, k.x, y, k.ancho, 'regular', k.size, k.leading);
+    }
+    y -= k.separacion;
+    drawWrapped(c, `Teléfono: ${tema.telefono}`, k.x, y, k.ancho, 'regular', k.size, k.leading);
+  }
+
+  function datosFactura(c, L, tema, datos) {
+    const d = L.datos;
+    c.setFont('bold', d.size);
+    c.setFillColor(tema.colores.accent);
+    if (datos.numero != null) {
+      c.drawRightString(d.numero_x, d.y, `No. ${String(datos.numero).padStart(6, '0')}`);
+    }
+    c.drawString(d.x, d.y, `FECHA: ${datos.fecha}`);
+    c.drawString(d.x, d.y - d.paso, `CLIENTE: ${datos.cliente}`);
+    c.drawString(d.x, d.y - 2 * d.paso, `ESTADO: ${datos.estado}`);
+    c.setFillColor(NEGRO);
+  }
+
+  function cabeceraTabla(c, L, textos, tema, y) {
+    const t = L.tabla;
+    c.setFont('bold', t.size);
+    c.setFillColor(tema.colores.primary);
+    t.columnas.forEach((x, i) => c.drawString(x, y, textos.cabecera_tabla[i]));
+    c.setStrokeColor(tema.colores.primary);
+    c.setLineWidth(1);
+    c.line(t.x, y - t.bajo_cabecera, t.x_fin, y - t.bajo_cabecera);
+  }
+
+  function filas(c, L, textos, tema, y, productos) {
+    const t = L.tabla;
+    const p = L.paginacion;
+    const [xCantidad, xPrecio, xTotal] = t.derechas;
+    c.setFont('regular', t.size);
+    let totalFactura = 0;
+    for (const [cantidad, descripcion, precio, total] of productos) {
+      if (y < p.y_minimo_filas) {
+        c.showPage();
+        y = p.y_nueva_pagina;
+        cabeceraTabla(c, L, textos, tema, y);
+        y -= t.despues_cabecera;
+      }
+
+      const lineas = simpleSplit(c, cap(descripcion), 'regular', t.size, t.ancho_descripcion);
+      lineas.forEach((linea, indice) => {
+        c.setFillColor(NEGRO);
+        c.drawString(t.x, y, linea);
+        if (indice === 0) {
+          c.drawRightString(xCantidad, y, String(cantidad));
+          c.drawRightString(xPrecio, y, `Q ${fijo2(precio)}`);
+          c.drawRightString(xTotal, y, `Q ${fijo2(total)}`);
+        }
+        y -= t.alto_linea;
+      });
+
+      c.setStrokeColor(tema.colores.line);
+      c.setLineWidth(t.grosor_separador);
+      c.line(t.x, y + t.sobre_separador, t.x_fin, y + t.sobre_separador);
+      c.setLineWidth(0.5);
+      totalFactura += total;
+    }
+    return [y, totalFactura];
+  }
+
+  function totalesYNota(c, L, textos, tema, y, totalFactura, pagoParcial) {
+    const t = L.totales;
+    if (y < L.paginacion.y_minimo_totales) {
+      c.showPage();
+      y = L.paginacion.y_nueva_pagina;
+    }
+    c.setFont('bold', t.size);
+    c.setFillColor(tema.colores.primary);
+    c.drawString(t.x, y - t.total, 'TOTAL:');
+    c.drawRightString(t.x_fin, y - t.total, `Q ${miles(totalFactura)}`);
+    c.line(t.x, y - t.linea, t.x_fin, y - t.linea);
+
+    if (pagoParcial) {
+      const saldo = Math.max(totalFactura - pagoParcial, 0);
+      c.setFont('regular', t.size_parcial);
+      c.setFillColor(tema.colores.accent);
+      c.drawString(t.x, y - t.parcial, 'Pago parcial:');
+      c.drawRightString(t.x_fin, y - t.parcial, `Q ${miles(pagoParcial)}`);
+      c.drawString(t.x, y - t.saldo, 'Saldo pendiente:');
+      c.drawRightString(t.x_fin, y - t.saldo, `Q ${miles(saldo)}`);
+      y -= t.desplazamiento_parcial;
+    }
+
+    c.setFont('italic', t.size_nota);
+    c.setFillColor(tema.colores.note);
+    c.drawString(t.nota_x, y - t.nota, textos.nota);
+    c.drawString(t.nota_x, y - t.gracias, textos.gracias);
+  }
+
+  // ---------- Logos ----------
+
+  const logos = new Map();
+
+  // El logo se re-codifica como JPEG sobre blanco: es lo que un PDF admite sin zlib.
+  async function cargarLogo(url) {
+    if (!url) return null;
+    if (!logos.has(url)) {
+      logos.set(url, (async () => {
+        const respuesta = await fetch(url);
+        if (!respuesta.ok) throw new Error(`Logo no disponible: ${url}`);
+        const bitmap = await createImageBitmap(await respuesta.blob());
+        const lienzo = document.createElement('canvas');
+        lienzo.width = lienzo.height = LADO_LOGO;
+        const ctx = lienzo.getContext('2d');
+        ctx.fillStyle = '#ffffff';
+        ctx.fillRect(0, 0, LADO_LOGO, LADO_LOGO);
+        ctx.drawImage(bitmap, 0, 0, LADO_LOGO, LADO_LOGO);
+        const datos = atob(lienzo.toDataURL('image/jpeg', 0.9).split(',')[1]);
+        return { ancho: LADO_LOGO, alto: LADO_LOGO, datos };
+      })().catch(error => {
+        logos.delete(url);
+        console.warn('[render_local]', error);
+        return null;
+      }));
+    }
+    return logos.get(url);
+  }
+
+  // ---------- Pedido: mismas reglas que el formulario guiado de app.py ----------
+
+  const PATRON_PRECIO = /(?<![\d.,])([$qQ]?\s*\d+(?:[.,]\d+)?)(?:\s*(?:c\/u|cada\s+uno|unidad|u)?)\s*$/i;
+  const CONECTORES = new Set(['a', 'x', 'por', 'precio', 'cada', 'c/u']);
+
+  function limpiarConectores(texto) {
+    const tokens = texto.trim().replace(/[-:]+$/, '').split(/\s+/).filter(Boolean);
+    while (tokens.length && CONECTORES.has(tokens[tokens.length - 1].toLowerCase())) tokens.pop();
+    return tokens.join(' ');
+  }
+
+  function normalizarPrecio(valor) {
+    valor = valor.trim().replace(/[Qq$ ]/g, '').replace(/,/g, '.');
+    const partes = valor.split('.');
+    if (partes.length > 2) {
+      const decimales = partes.pop();
+      valor = partes.join('') + '.' + decimales;
+    }
+    return parseFloat(valor);
+  }
+
+  function parsearProductos(texto) {
+    const productos = [];
+    const lineas = (texto || '').split('\n').map(l => l.trim()).filter(Boolean);
+    lineas.forEach((linea, i) => {
+      const tokens = linea.split(/\s+/);
+      if (!/^\d+$/.test(tokens[0])) throw new Error(`Línea ${i + 1}: la cantidad debe ir en números.`);
+      const cantidad = parseInt(tokens[0], 10);
+      const resto = tokens.slice(1).join(' ');
+      const match = PATRON_PRECIO.exec(resto);
+      if (!match) throw new Error(`Línea ${i + 1}: no se identificó el precio al final de la línea.`);
+      const precio = normalizarPrecio(match[1]);
+      const descripcion = limpiarConectores(resto.slice(0, match.index));
+      if (!descripcion || !Number.isFinite(precio)) throw new Error(`Línea ${i + 1}: revisa la descripción y el precio.`);
+      productos.push([cantidad, descripcion, precio, cantidad * precio]);
+    });
+    const clave = p => p[1].toLowerCase();
+    productos.sort((a, b) => (clave(a) < clave(b) ? -1 : clave(a) > clave(b) ? 1 : 0));
+    return productos;
+  }
+
+  // ---------- API ----------
+
+  function nombreArchivo(cliente, fecha) {
+    const seguro = (cliente || '').trim().replace(/ /g, '_').replace(/[\\/:*?"<>|]+/g, '') || 'Cliente';
+    return `${seguro}_Comprobante${fecha.replace(/\//g, '-')}.pdf`;
+  }
+
+  async function cargarLayout(base) {
+    const respuesta = await fetch(`${base}/layout.json`);
+    if (!respuesta.ok) throw new Error('No se pudo obtener el layout del comprobante.');
+    const spec = await respuesta.json();
+    // Deja los logos en la caché del service worker para cuando no haya conexión.
+    Object.values(spec.plantillas || {}).forEach(tema => cargarLogo(tema.logo));
+    return spec;
+  }
+
+  /**
+   * datos: {plantilla, cliente, estado, fecha: 'dd/mm/aaaa', productos: texto, pago_parcial, numero}
+   * Devuelve {blob, nombre}.
+   */
+  async function generarPdf(spec, datos) {
+    if (!spec || spec.version !== VERSION_LAYOUT) {
+      throw new Error('El comprobante sin conexión necesita actualizar la página.');
+    }
+    const tema = spec.plantillas[datos.plantilla] || Object.values(spec.plantillas)[0];
+    const productos = parsearProductos(datos.productos);
+    const total = productos.reduce((suma, p) => suma + p[3], 0);
+    if (total <= 0) throw new Error('El total calculado es 0. Revisa los productos ingresados.');
+    if (datos.pago_parcial && datos.pago_parcial > total) {
+      throw new Error('El pago parcial no puede ser mayor al total calculado.');
+    }
+
+    const L = spec.layout;
+    const c = new Lienzo(spec);
+    encabezado(c, L, tema, await cargarLogo(tema.logo));
+    datosFactura(c, L, tema, datos);
+    let y = L.tabla.y;
+    cabeceraTabla(c, L, spec.textos, tema, y);
+    y -= L.tabla.despues_cabecera;
+    let totalFactura;
+    [y, totalFactura] = filas(c, L, spec.textos, tema, y, productos);
+    totalesYNota(c, L, spec.textos, tema, y, totalFactura, datos.pago_parcial || 0);
+
+    const binario = c.save({ titulo: 'Comprobante', autor: tema.titulo });
+    const bytes = new Uint8Array(binario.length);
+    for (let i = 0; i < binario.length; i++) bytes[i] = binario.charCodeAt(i) & 0xFF;
+    return { blob: new Blob([bytes], { type: 'application/pdf' }), nombre: nombreArchivo(datos.cliente, datos.fecha) };
+  }
+
+  global.RenderLocal = { VERSION_LAYOUT, cargarLayout, generarPdf, parsearProductos };
+})(window);
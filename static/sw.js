@@ -0,0 +1,53 @@
+// sw.js
+// Guarda la página, el render local, /layout.json y los logos para poder
+// generar comprobantes sin conexión. Se sirve desde /sw.js (alcance "/").
+const CACHE = 'comprobantes-v1';
+const PRECARGA = ['/static/render_local.js'];
+
+self.addEventListener('install', evento => {
+  evento.waitUntil(caches.open(CACHE).then(cache => cache.addAll(PRECARGA)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', evento => {
+  evento.waitUntil(
+    caches.keys()
+      .then(claves => Promise.all(claves.filter(clave => clave !== CACHE).map(clave => caches.delete(clave))))
+      .then(() => self.clients.claim())
+  );
+});
+
+// Red primero: la página, el render y el layout deben estar al día cuando hay conexión.
+async function redPrimero(peticion) {
+  const cache = await caches.open(CACHE);
+  try {
+    const respuesta = await fetch(peticion);
+    if (respuesta.ok) cache.put(peticion, respuesta.clone());
+    return respuesta;
+  } catch (error) {
+    const guardada = await cache.match(peticion);
+    if (guardada) return guardada;
+    throw error;
+  }
+}
+
+// Caché primero para el resto de archivos estáticos (logos).
+async function cachePrimero(peticion) {
+  const cache = await caches.open(CACHE);
+  const guardada = await cache.match(peticion);
+  if (guardada) return guardada;
+  const respuesta = await fetch(peticion);
+  if (respuesta.ok) cache.put(peticion, respuesta.clone());
+  return respuesta;
+}
+
+self.addEventListener('fetch', evento => {
+  const peticion = evento.request;
+  const url = new URL(peticion.url);
+  if (peticion.method !== 'GET' || url.origin !== self.location.origin) return;
+
+  if (peticion.mode === 'navigate' || url.pathname.endsWith('/layout.json') || PRECARGA.includes(url.pathname)) {
+    evento.respondWith(redPrimero(peticion));
+  } else if (url.pathname.startsWith('/static/')) {
+    evento.respondWith(cachePrimero(peticion));
+  }
+});
@@ -0,0 +1,28 @@
+"""
+Las pruebas marcadas con @pytest.mark.benchmark miden tiempo de reloj y fallan
+en máquinas cargadas; solo corren con FACTURAS_BENCHMARK=1:
+    FACTURAS_BENCHMARK=1 python -m pytest -m benchmark
+"""
+import os
+
+import pytest
+
+BENCHMARK = os.environ.get("FACTURAS_BENCHMARK") == "1"
+
+# Las pruebas de la aplicación renderizan los mismos pedidos contra bases
+# distintas: sin esto reutilizarían PDFs publicados por otra prueba en el
+# directorio compartido entre workers (tests/test_coalescencia.py lo cubre aparte).
+os.environ.setdefault("FACTURAS_COALESCER_DIR", "0")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: mide tiempo de reloj; requiere FACTURAS_BENCHMARK=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    if BENCHMARK:
+        return
+    omitir = pytest.mark.skip(reason="benchmark: define FACTURAS_BENCHMARK=1 para medir tiempos")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(omitir)
@@ -0,0 +1,52 @@
+from pathlib import Path
+import sys
+
+import pytest
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from generar_factura import PAGE_WIDTH, generar_artefactos, generar_imagen_factura
+
+PRODUCTOS = [
+    [2, "calcetas deportivas", 25.0, 50.0],
+    [1, "pantalon nike", 200.0, 200.0],
+]
+
+
+@pytest.fixture(autouse=True)
+def _raiz_del_repo(monkeypatch):
+    # Las rutas de los logos en THEMES son relativas a la raíz del proyecto.
+    monkeypatch.chdir(ROOT)
+
+
+def test_pdf_y_miniatura_en_una_llamada():
+    artefactos = generar_artefactos("Ana", "PAGADO", "10/09/2024", PRODUCTOS, tema="B")
+
+    assert artefactos["pdf"].getvalue().startswith(b"%PDF")
+    assert artefactos["png"] is None
+    miniatura = Image.open(artefactos["miniatura"])
+    assert miniatura.format == "PNG"
+    assert miniatura.width == 360
+    assert miniatura.height < miniatura.width * 2
+
+
+def test_sin_miniatura_y_con_png_completo():
+    artefactos = generar_artefactos(
+        "Ana", "PAGADO", "10/09/2024", PRODUCTOS, miniatura=False, png=True
+    )
+
+    assert artefactos["miniatura"] is None
+    assert Image.open(artefactos["png"]).width == round(PAGE_WIDTH * 2)
+
+
+def test_imagen_factura_usa_el_mismo_layout():
+    productos = [[1, f"producto {i}", 10.0, 10.0] for i in range(80)]
+
+    imagen = Image.open(generar_imagen_factura("Ana", "PAGADO", "10/09/2024", productos))
+
+    # Solo la primera página del PDF se convierte en imagen, recortada al contenido.
+    assert imagen.width == round(PAGE_WIDTH * 2)
+    assert 1040 <= imagen.height <= 1584
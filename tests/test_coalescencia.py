@@ -0,0 +1,86 @@
+from pathlib import Path
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from coalescencia import Coalescedor, clave_pedido
+
+
+def _concurrentes(coalescedor, clave, funcion, n=5):
+    resultados = []
+    errores = []
+
+    def tarea():
+        try:
+            resultados.append(coalescedor.ejecutar(clave, funcion))
+        except Exception as exc:
+            errores.append(exc)
+
+    hilos = [threading.Thread(target=tarea) for _ in range(n)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados, errores
+
+
+def test_clave_pedido_estable():
+    productos = [[2, "calcetas", 25.0, 50.0]]
+    assert clave_pedido("A", "Ana", productos) == clave_pedido("A", "Ana", [[2, "calcetas", 25.0, 50.0]])
+    assert clave_pedido("A", "Ana", productos) != clave_pedido("B", "Ana", productos)
+
+
+def test_peticiones_simultaneas_comparten_un_render():
+    coalescedor = Coalescedor()
+    llamadas = []
+
+    def render():
+        llamadas.append(1)
+        time.sleep(0.2)
+        return b"%PDF"
+
+    resultados, errores = _concurrentes(coalescedor, "x", render)
+
+    assert not errores
+    assert resultados == [b"%PDF"] * 5
+    assert len(llamadas) == 1
+    assert coalescedor.metricas() == {"renders": 1, "renders_ahorrados": 4, "en_curso": 0}
+
+
+def test_error_del_lider_se_propaga():
+    coalescedor = Coalescedor()
+
+    def render():
+        time.sleep(0.2)
+        raise ValueError("falló")
+
+    resultados, errores = _concurrentes(coalescedor, "x", render, n=3)
+
+    assert not resultados
+    assert len(errores) == 3
+    # Un nuevo intento ya no queda atado al vuelo fallido.
+    assert coalescedor.ejecutar("x", lambda: b"ok") == b"ok"
+
+
+def test_directorio_compartido_entre_workers(tmp_path):
+    pytest.importorskip("fcntl")
+    llamadas = []
+
+    def render():
+        llamadas.append(1)
+        return b"%PDF"
+
+    # Dos instancias simulan dos workers que reciben el mismo pedido.
+    uno = Coalescedor(directorio=str(tmp_path))
+    dos = Coalescedor(directorio=str(tmp_path))
+
+    assert uno.ejecutar("abc", render) == b"%PDF"
+    assert dos.ejecutar("abc", render) == b"%PDF"
+    assert len(llamadas) == 1
+    assert dos.metricas()["renders_ahorrados"] == 1
@@ -0,0 +1,117 @@
+"""
+Pruebas golden del PDF determinista. También sirven como línea base de tiempo
+de render: cada caso guarda su tiempo y, con FACTURAS_BENCHMARK=1, la prueba
+falla si se vuelve mucho más lento (ver conftest.py).
+
+Para regenerar tras un cambio intencional del diseño:
+    ACTUALIZAR_GOLDEN=1 python -m pytest tests/test_golden.py
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import sys
+import time
+
+import pytest
+import reportlab
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import generar_factura
+from generar_factura import generar_factura as render
+
+GOLDEN = Path(__file__).parent / "golden" / "facturas.json"
+ACTUALIZAR = os.environ.get("ACTUALIZAR_GOLDEN") == "1"
+# Margen sobre la línea base: cubre el ruido entre máquinas, no una regresión real.
+FACTOR_TIEMPO = 4
+MARGEN_MS = 50
+
+CASOS = [(tema, n) for tema in ("A", "B") for n in (1, 12, 60)]
+
+
+def _productos(n):
+    return [
+        [i % 4 + 1, f"producto {i} " + "largo " * (i % 3), 10.0 + i, (i % 4 + 1) * (10.0 + i)]
+        for i in range(n)
+    ]
+
+
+def _entorno():
+    return {
+        "reportlab": reportlab.Version,
+        "fuentes": [generar_factura.FONT_REGULAR, generar_factura.FONT_BOLD, generar_factura.FONT_ITALIC],
+    }
+
+
+def _render(tema, n):
+    return render(
+        "Cliente Golden",
+        "PAGO PARCIAL",
+        "10/09/2024",
+        _productos(n),
+        tema=tema,
+        pago_parcial=5.0,
+        deterministico=True,
+    ).getvalue()
+
+
+def _mejor_ms(tema, n, repeticiones=3):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        _render(tema, n)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor * 1000
+
+
+@pytest.fixture(scope="module")
+def golden():
+    if ACTUALIZAR:
+        datos = {"entorno": _entorno(), "casos": {}}
+        yield datos
+        GOLDEN.write_text(json.dumps(datos, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        return
+    if not GOLDEN.exists():
+        pytest.skip("No hay archivo golden; genera uno con ACTUALIZAR_GOLDEN=1.")
+    datos = json.loads(GOLDEN.read_text(encoding="utf-8"))
+    if datos["entorno"] != _entorno():
+        pytest.skip(f"Golden generado con otro entorno: {datos['entorno']}")
+    yield datos
+
+
+@pytest.fixture(autouse=True)
+def _raiz_del_repo(monkeypatch):
+    monkeypatch.chdir(ROOT)
+
+
+def test_render_determinista():
+    assert _render("A", 3) == _render("A", 3)
+
+
+@pytest.mark.parametrize("tema,n", CASOS)
+def test_pdf_coincide_con_golden(golden, tema, n, tmp_path):
+    clave = f"{tema}-{n}"
+    pdf = _render(tema, n)
+    digest = hashlib.sha256(pdf).hexdigest()
+
+    if ACTUALIZAR:
+        golden["casos"][clave] = {"sha256": digest, "bytes": len(pdf), "ms": round(_mejor_ms(tema, n), 1)}
+        return
+
+    esperado = golden["casos"][clave]
+    if digest != esperado["sha256"]:
+        salida = tmp_path / f"{clave}.pdf"
+        salida.write_bytes(pdf)
+        pytest.fail(f"El PDF {clave} cambió ({len(pdf)} vs {esperado['bytes']} bytes); revisa {salida}")
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("tema,n", CASOS)
+def test_tiempo_de_render_no_empeora(golden, tema, n):
+    if ACTUALIZAR:
+        pytest.skip("Actualizando la línea base.")
+    base = golden["casos"][f"{tema}-{n}"]["ms"]
+    assert _mejor_ms(tema, n) < base * FACTOR_TIEMPO + MARGEN_MS
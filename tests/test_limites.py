@@ -0,0 +1,94 @@
+from pathlib import Path
+import sys
+import time
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from limites import Limitador, MemoriaStore, Rechazo, SQLiteStore
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memoria":
+        return MemoriaStore()
+    return SQLiteStore(str(tmp_path / "limites.db"))
+
+
+def test_rafaga_y_luego_rechazo_con_retry_after(store):
+    limitador = Limitador(store=store, tasa=0.5, rafaga=3)
+
+    for _ in range(3):
+        limitador.admitir("1.2.3.4")
+    with pytest.raises(Rechazo) as exc:
+        limitador.admitir("1.2.3.4")
+
+    assert exc.value.status == 429
+    assert exc.value.retry_after == 2
+    # Cada cliente tiene su propia cubeta.
+    limitador.admitir("5.6.7.8")
+    assert limitador.metricas()["rechazadas_tasa"] == 1
+    assert limitador.metricas()["admitidas"] == 4
+
+
+def test_tope_de_renders_simultaneos(store):
+    limitador = Limitador(store=store, max_renders=2)
+
+    with limitador.slot_render(), limitador.slot_render():
+        assert limitador.metricas()["renders_en_curso"] == 2
+        with pytest.raises(Rechazo) as exc:
+            with limitador.slot_render():
+                pass
+        assert exc.value.status == 503
+
+    assert limitador.metricas()["renders_en_curso"] == 0
+    with limitador.slot_render():
+        pass
+    assert limitador.metricas()["rechazadas_ocupado"] == 1
+
+
+def test_sqlite_comparte_contadores_entre_instancias(tmp_path):
+    path = str(tmp_path / "limites.db")
+    uno = Limitador(store=SQLiteStore(path), max_renders=1)
+    dos = Limitador(store=SQLiteStore(path), max_renders=1)
+
+    with uno.slot_render():
+        with pytest.raises(Rechazo):
+            with dos.slot_render():
+                pass
+
+
+def test_slot_vencido_se_recupera(tmp_path):
+    store = SQLiteStore(str(tmp_path / "limites.db"), ttl_slot=-1)
+    assert store.adquirir_slot(1) is not None
+    # El slot anterior quedó sin liberar (worker caído) pero ya expiró.
+    assert store.adquirir_slot(1) is not None
+
+
+def test_purga_no_borra_cubetas_de_otro_espacio(store):
+    store.MAX_CLAVES = 0
+    lenta = Limitador(store=store, tasa=0.001, rafaga=1, espacio="lenta")
+    rapida = Limitador(store=store, tasa=1e6, rafaga=5, espacio="rapida")
+
+    lenta.admitir("1.2.3.4")
+    # La purga que dispara la tienda rápida no debe regalarle un token a la lenta.
+    rapida.admitir("1.2.3.4")
+    with pytest.raises(Rechazo):
+        lenta.admitir("1.2.3.4")
+
+
+def test_render_largo_renueva_su_slot(tmp_path):
+    store = SQLiteStore(str(tmp_path / "limites.db"), ttl_slot=1.0)
+    limitador = Limitador(store=store, max_renders=1)
+
+    with limitador.slot_render() as renovar:
+        for _ in range(3):
+            time.sleep(0.4)
+            renovar()
+        # Pasó más que el TTL, pero el slot renovado sigue ocupado.
+        with pytest.raises(Rechazo):
+            with limitador.slot_render():
+                pass
@@ -0,0 +1,123 @@
+from pathlib import Path
+import sys
+import tracemalloc
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import generar_factura
+import historial
+from generar_factura import estimar_memoria_factura, estimar_memoria_reporte, generar_artefactos
+from limites import Rechazo
+from memoria import ControlMemoria
+
+
+def test_techo_rechaza_antes_de_renderizar():
+    control = ControlMemoria(techo=1000)
+
+    control.admitir(1000, "grande")
+    with pytest.raises(Rechazo) as exc:
+        control.admitir(1001, "demasiado grande")
+
+    assert exc.value.status == 413
+    assert exc.value.retry_after is None
+    assert control.metricas()["rechazadas"] == 1
+    # Sin techo se admite todo.
+    ControlMemoria().admitir(10 ** 12, "x")
+
+
+def test_medicion_por_muestreo():
+    control = ControlMemoria(muestreo=1)
+
+    with control.medir("prueba", estimado=4096):
+        datos = bytearray(2 * 1024 * 1024)
+    del datos
+
+    metricas = control.metricas()
+    assert metricas["mediciones"] == 1
+    assert metricas["ultima"]["nombre"] == "prueba"
+    assert metricas["ultima"]["estimado"] == 4096
+    assert metricas["pico_max"] >= 2 * 1024 * 1024
+    assert not tracemalloc.is_tracing()
+
+    with ControlMemoria(muestreo=0).medir("nunca"):
+        assert not tracemalloc.is_tracing()
+
+
+def test_medicion_respeta_tracemalloc_existente():
+    tracemalloc.start()
+    try:
+        with ControlMemoria(muestreo=1).medir("prueba"):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_estimaciones_crecen_con_el_trabajo():
+    base = estimar_memoria_factura(1)
+    assert estimar_memoria_factura(1000) > base
+    assert estimar_memoria_factura(1, miniatura=True) > base
+    # El PNG completo a 2x pesa más que la miniatura.
+    assert estimar_memoria_factura(1, png=True) > estimar_memoria_factura(1, miniatura=True)
+    assert estimar_memoria_reporte(100, 500) > estimar_memoria_reporte(10, 50)
+
+
+def test_logo_se_decodifica_una_vez(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    productos = [[1, "balón", 90.0, 90.0]]
+    generar_artefactos("Ana", "PAGADO", "10/09/2024", productos, miniatura=False)
+    antes = generar_factura._logo_pdf.cache_info()
+
+    generar_artefactos("Ana", "PAGADO", "10/09/2024", productos, miniatura=False)
+
+    despues = generar_factura._logo_pdf.cache_info()
+    assert despues.misses == antes.misses
+    assert despues.hits > antes.hits
+
+
+@pytest.fixture
+def aplicacion(tmp_path, monkeypatch):
+    import app as aplicacion
+    from limites import Limitador
+
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(historial, "DB_PATH", str(tmp_path / "facturas.db"))
+    monkeypatch.setattr(
+        aplicacion, "limitadores_tienda", {slug: Limitador(rafaga=100) for slug in aplicacion.TIENDAS}
+    )
+    return aplicacion
+
+
+def _sin_render(*args, **kwargs):
+    raise AssertionError("no debe renderizar")
+
+
+def test_pedido_demasiado_grande_responde_413(aplicacion, monkeypatch):
+    monkeypatch.setattr(aplicacion, "memoria", ControlMemoria(techo=estimar_memoria_factura(5)))
+    monkeypatch.setattr(aplicacion, "generar_artefactos", _sin_render)
+    productos = "\n".join(f"{i + 1} producto {i} a 10" for i in range(6))
+    datos = {"cliente": "Ana", "estado": "PAGADO", "fecha": "2024-09-10", "productos": productos}
+
+    respuesta = aplicacion.app.test_client().post("/generar_desde_texto", data=datos)
+
+    assert respuesta.status_code == 413
+    assert "Retry-After" not in respuesta.headers
+
+
+def test_reporte_demasiado_grande_responde_413(aplicacion, monkeypatch):
+    productos = [[1, f"producto {i}", 5.0, 5.0] for i in range(40)]
+    for _ in range(3):
+        historial.registrar("Ana", "PAGADO", "10/09/2024", productos)
+    assert historial.resumen("2024-09-10", "2024-09-10")["productos"] == 120
+
+    monkeypatch.setattr(aplicacion, "memoria", ControlMemoria(techo=estimar_memoria_reporte(3, 100)))
+    monkeypatch.setattr(aplicacion, "generar_reporte", _sin_render)
+    monkeypatch.setattr(aplicacion, "REPORTE_SECRETO", "cierre")
+
+    respuesta = aplicacion.app.test_client().get("/reporte?desde=2024-09-10", headers={"X-Reporte": "cierre"})
+
+    assert respuesta.status_code == 413
@@ -0,0 +1,171 @@
+from decimal import Decimal
+from pathlib import Path
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("hypothesis")
+from hypothesis import given, strategies as st
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from app import (
+    MAX_LARGO_LINEA,
+    MAX_LARGO_MENSAJE,
+    CONNECTORES_TOTALES,
+    ValidacionError,
+    _normalizar_precio,
+    parsear_mensaje,
+    parsear_productos,
+)
+
+# Palabras de descripción que el parser no confunde con conectores ni precios.
+palabras = st.text(alphabet="abcdefghijklmnñopqrstuvwxyzáéíóú", min_size=2, max_size=12).filter(
+    lambda p: p not in CONNECTORES_TOTALES
+)
+descripciones = st.lists(palabras, min_size=1, max_size=6).map(" ".join)
+precios = st.decimals(min_value=0, max_value=99999, places=2, allow_nan=False, allow_infinity=False)
+cantidades = st.integers(min_value=1, max_value=999)
+
+
+def _formatear_precio(precio: Decimal, separador: str, prefijo: str) -> str:
+    texto = f"{precio:.2f}".replace(".", separador)
+    return f"{prefijo}{texto}"
+
+
+@given(
+    cantidad=cantidades,
+    descripcion=descripciones,
+    precio=precios,
+    conector=st.sampled_from(["a", "x", "por", "precio"]),
+    separador=st.sampled_from([".", ","]),
+    prefijo=st.sampled_from(["", "Q", "q", "$", "Q "]),
+)
+def test_linea_producto_ida_y_vuelta(cantidad, descripcion, precio, conector, separador, prefijo):
+    linea = f"{cantidad} {descripcion} {conector} {_formatear_precio(precio, separador, prefijo)}"
+
+    [producto] = parsear_productos(linea)
+
+    assert producto == [cantidad, descripcion, float(precio), cantidad * float(precio)]
+
+
+@given(st.lists(st.tuples(cantidades, descripciones, precios), min_size=1, max_size=20))
+def test_mensaje_completo_ida_y_vuelta(items):
+    lineas = ["CLIENTE Ana", "ESTADO Pagado", "FECHA HOY"]
+    lineas += [f"{c} {d} a {p:.2f}" for c, d, p in items]
+
+    cliente, estado, fecha, productos = parsear_mensaje("\n".join(lineas))
+
+    assert (cliente, estado, fecha) == ("Ana", "Pagado", "HOY")
+    assert productos == [[c, d, float(p), c * float(p)] for c, d, p in items]
+
+
+@given(st.text(max_size=MAX_LARGO_LINEA * 2))
+def test_texto_arbitrario_solo_produce_validacion_error(texto):
+    for parser in (parsear_mensaje, parsear_productos):
+        try:
+            parser(texto)
+        except ValidacionError:
+            pass
+
+
+@given(st.lists(st.integers(min_value=0, max_value=999), min_size=2, max_size=50))
+def test_normalizar_precio_separadores_de_miles(grupos):
+    valor = ".".join(str(g) for g in grupos)
+    esperado = float("".join(str(g) for g in grupos[:-1]) + "." + str(grupos[-1]))
+    assert _normalizar_precio(valor) == esperado
+
+
+def test_limites_de_largo():
+    with pytest.raises(ValidacionError, match="demasiado largo"):
+        parsear_mensaje("1 " * (MAX_LARGO_MENSAJE // 2 + 1))
+    with pytest.raises(ValidacionError, match="Línea 1: La línea es demasiado larga"):
+        parsear_productos("1 pelota " + "x" * MAX_LARGO_LINEA + " a 5")
+
+
+# =========================
+# Regresión de rendimiento
+# =========================
+PATOLOGICAS = {
+    "separadores": lambda n: "1 balón a " + ".".join("1" * n),
+    "digitos": lambda n: "1 balón a " + "1" * n + "x",
+    "espacios": lambda n: "1 balón" + " " * n + "a 5",
+    "tokens": lambda n: "1 " + "a " * n + "5",
+    "cantidad_palabras": lambda n: "treinta y " * n + "balón a 5",
+}
+
+# Cada caso se compara con una línea válida del mismo largo medida en la misma
+# máquina; el margen absoluto cubre la resolución del reloj en líneas cortas.
+# Miden tiempo de reloj, así que solo corren con FACTURAS_BENCHMARK=1.
+FACTOR_TIEMPO = 10
+MARGEN_S = 0.0002
+
+
+def _mejor_tiempo(funcion, repeticiones=5):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def _linea_normal(largo):
+    cuerpo = ("balón " * largo)[: largo - len("1  a 5")].strip()
+    return f"1 {cuerpo} a 5"
+
+
+def _analizar(texto):
+    try:
+        parsear_productos(texto)
+    except ValidacionError:
+        pass
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("nombre", sorted(PATOLOGICAS))
+def test_linea_patologica_en_el_limite_es_rapida(nombre):
+    generar = PATOLOGICAS[nombre]
+    n = 1
+    while len(generar(n * 2)) <= MAX_LARGO_LINEA:
+        n *= 2
+    linea = generar(n)
+    base = _mejor_tiempo(lambda: _analizar(_linea_normal(len(linea))))
+
+    assert _mejor_tiempo(lambda: _analizar(linea)) < base * FACTOR_TIEMPO + MARGEN_S
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("nombre", sorted(PATOLOGICAS))
+def test_tiempo_por_linea_crece_linealmente(nombre):
+    linea = PATOLOGICAS[nombre](8)
+    por_mensaje = max(1, MAX_LARGO_MENSAJE // (len(linea) + 1))
+    chico = "\n".join([linea] * (por_mensaje // 8))
+    grande = "\n".join([linea] * por_mensaje)
+
+    t_chico = _mejor_tiempo(lambda: _analizar(chico))
+    t_grande = _mejor_tiempo(lambda: _analizar(grande))
+
+    # 8 veces más líneas; se tolera ruido pero no un crecimiento cuadrático.
+    assert t_grande < t_chico * 8 * 3 + 0.002
+
+
+@pytest.mark.benchmark
+def test_mensaje_sobre_el_limite_se_rechaza_sin_analizar():
+    texto = "1 balón a " + ".".join("1" * MAX_LARGO_MENSAJE)
+    linea = _linea_normal(60)
+    en_el_limite = "\n".join([linea] * (MAX_LARGO_MENSAJE // (len(linea) + 1)))
+    base = _mejor_tiempo(lambda: _analizar(en_el_limite))
+
+    # Rechazar por largo no debe costar ni una fracción de analizar un mensaje válido.
+    assert _mejor_tiempo(lambda: _analizar(texto)) < base / FACTOR_TIEMPO
+
+
+def test_superindices_no_son_cantidades():
+    # '¹'.isdigit() es verdadero pero int('¹') falla; no debe escapar un ValueError.
+    with pytest.raises(ValidacionError):
+        parsear_productos("¹ balón a 5")
+    assert parsear_mensaje("¹ balón a 5")[3] == []
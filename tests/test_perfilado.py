@@ -0,0 +1,74 @@
+from pathlib import Path
+import sys
+import time
+
+import pytest
+from flask import Flask
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+from perfilado import Perfilador
+
+
+def _app(perfilador):
+    app = Flask(__name__)
+
+    @app.route("/lento")
+    @perfilador.perfilable
+    def lento():
+        fin = time.perf_counter() + 0.05
+        while time.perf_counter() < fin:
+            pass
+        return "ok"
+
+    return app.test_client()
+
+
+def test_sin_secreto_no_se_perfila(tmp_path):
+    perfilador = Perfilador(secreto="s3cr3t", directorio=str(tmp_path))
+    respuesta = _app(perfilador).get("/lento", headers={"X-Perfil": "otro"})
+
+    assert respuesta.data == b"ok"
+    assert "X-Perfil-Archivo" not in respuesta.headers
+    assert perfilador.listar() == []
+
+
+def test_muestreo_genera_collapsed_stack(tmp_path):
+    perfilador = Perfilador(secreto="s3cr3t", directorio=str(tmp_path), intervalo=0.001)
+    respuesta = _app(perfilador).get("/lento", headers={"X-Perfil": "s3cr3t"})
+
+    nombre = respuesta.headers["X-Perfil-Archivo"]
+    assert nombre.endswith(".txt")
+    lineas = Path(perfilador.ruta(nombre)).read_text(encoding="utf-8").splitlines()
+    assert lineas
+    pila, cuenta = lineas[0].rsplit(" ", 1)
+    assert "lento" in pila
+    assert int(cuenta) > 0
+
+
+def test_cprofile_por_parametro(tmp_path):
+    import pstats
+
+    perfilador = Perfilador(secreto="s3cr3t", directorio=str(tmp_path))
+    respuesta = _app(perfilador).get("/lento?perfil=s3cr3t&perfil_modo=cprofile")
+
+    nombre = respuesta.headers["X-Perfil-Archivo"]
+    assert nombre.endswith(".prof")
+    assert pstats.Stats(perfilador.ruta(nombre)).total_calls > 0
+
+
+def test_tope_de_archivos(tmp_path):
+    perfilador = Perfilador(directorio=str(tmp_path), muestreo=1, max_archivos=2)
+    cliente = _app(perfilador)
+    for _ in range(4):
+        cliente.get("/lento")
+        time.sleep(0.01)
+
+    assert len(perfilador.listar()) == 2
+
+
+@pytest.mark.parametrize("nombre", ["../app.py", "no-existe.txt"])
+def test_ruta_rechaza_nombres_ajenos(tmp_path, nombre):
+    assert Perfilador(directorio=str(tmp_path)).ruta(nombre) is None
@@ -0,0 +1,153 @@
+import io
+from pathlib import Path
+import re
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import generar_factura
+import historial
+from generar_factura import generar_reporte
+
+
+def _registrar_dia(db):
+    historial.registrar("Ana", "PAGADO", "10/09/2024", [[2, "calcetas", 25.0, 50.0]], db_path=db)
+    historial.registrar(
+        "Luis", "PAGO PARCIAL", "10/09/2024", [[1, "pantalon", 200.0, 200.0]],
+        plantilla="B", pago_parcial=80.0, db_path=db,
+    )
+    historial.registrar("Ana", "PENDIENTE", "11/09/2024", [[3, "gorras", 45.0, 135.0]], db_path=db)
+
+
+def test_resumen_por_estado_y_cliente(tmp_path):
+    db = str(tmp_path / "facturas.db")
+    _registrar_dia(db)
+
+    datos = historial.resumen("2024-09-10", "2024-09-10", db_path=db)
+
+    assert datos["cantidad"] == 2
+    assert datos["total"] == 250.0
+    assert datos["abonado"] == 80.0
+    assert datos["saldo"] == 120.0
+    assert [f["estado"] for f in datos["por_estado"]] == ["PAGADO", "PAGO PARCIAL"]
+    assert [f["cliente"] for f in datos["por_cliente"]] == ["Luis", "Ana"]
+
+
+def test_iterar_facturas_en_orden_y_por_plantilla(tmp_path):
+    db = str(tmp_path / "facturas.db")
+    _registrar_dia(db)
+
+    facturas = list(historial.iterar_facturas("2024-09-10", "2024-09-11", db_path=db))
+    assert [f["cliente"] for f in facturas] == ["Ana", "Luis", "Ana"]
+    assert facturas[0]["fecha"] == "10/09/2024"
+    assert facturas[1]["productos"] == [[1, "pantalon", 200.0, 200.0]]
+
+    solo_b = list(historial.iterar_facturas("2024-09-10", "2024-09-11", plantilla="B", db_path=db))
+    assert [f["cliente"] for f in solo_b] == ["Luis"]
+
+
+def _reporte(db, desde="2024-09-10", hasta="2024-09-11"):
+    with generar_reporte(
+        historial.resumen(desde, hasta, db_path=db),
+        historial.iterar_facturas(desde, hasta, db_path=db),
+        desde,
+        hasta,
+    ) as archivo:
+        return archivo.read()
+
+
+def test_generar_reporte_una_pagina_por_comprobante(tmp_path):
+    db = str(tmp_path / "facturas.db")
+    _registrar_dia(db)
+
+    pdf = _reporte(db)
+
+    assert pdf.startswith(b"%PDF")
+    assert pdf.count(b"/Type /Page\n") == 4
+
+
+def test_generar_reporte_reutiliza_logos(tmp_path):
+    db = str(tmp_path / "facturas.db")
+    _registrar_dia(db)
+    imagenes = _reporte(db).count(b"/Subtype /Image")
+
+    for _ in range(5):
+        historial.registrar("Eva", "PAGADO", "11/09/2024", [[1, "balón", 90.0, 90.0]], db_path=db)
+
+    # Más comprobantes con la misma plantilla no vuelven a incrustar el logo.
+    assert _reporte(db).count(b"/Subtype /Image") == imagenes
+
+
+def test_generar_reporte_por_bloques_es_un_pdf_valido(tmp_path, monkeypatch):
+    db = str(tmp_path / "facturas.db")
+    _registrar_dia(db)
+    for _ in range(4):
+        historial.registrar("Eva", "PAGADO", "11/09/2024", [[1, "balón", 90.0, 90.0]], db_path=db)
+    monkeypatch.setattr(generar_factura, "_COMPROBANTES_POR_BLOQUE", 3)
+
+    pdf = _reporte(db)
+
+    # Resumen más 7 comprobantes en tres bloques colgados de una sola raíz.
+    assert pdf.count(b"/Type /Page\n") == 8
+    assert pdf.count(b"/Type /Catalog") == 1
+    assert re.search(rb"/Count 8 /Kids \[ (\d+ 0 R ?){3}\] /Type /Pages", pdf)
+    # Cada entrada de la tabla xref apunta al objeto con ese número.
+    inicio = int(pdf.rsplit(b"startxref", 1)[1].split()[0])
+    lineas = pdf[inicio:].split(b"\n")
+    cantidad = int(lineas[1].split()[1])
+    for numero, linea in enumerate(lineas[3:cantidad + 2], start=1):
+        posicion = int(linea[:10])
+        assert pdf[posicion:].startswith(b"%d 0 obj" % numero)
+
+
+def test_reporte_por_bloques_se_lee_con_pypdf(tmp_path, monkeypatch):
+    pypdf = pytest.importorskip("pypdf")
+    db = str(tmp_path / "facturas.db")
+    _registrar_dia(db)
+    for i in range(4):
+        historial.registrar(f"Eva {i}", "PAGADO", "11/09/2024", [[1, "balón", 90.0, 90.0]], db_path=db)
+    monkeypatch.setattr(generar_factura, "_COMPROBANTES_POR_BLOQUE", 3)
+
+    lector = pypdf.PdfReader(io.BytesIO(_reporte(db)), strict=True)
+
+    assert len(lector.pages) == 8
+    assert "CLIENTE: Eva 3" in lector.pages[7].extract_text()
+    # Cada bloque trae su propio subconjunto de DejaVu con una etiqueta única;
+    # el logo se escribe una sola vez y todos los bloques lo comparten.
+    subconjuntos, logos = {}, set()
+    for pagina in lector.pages:
+        recursos = pagina["/Resources"]
+        for fuente in recursos["/Font"].values():
+            nombre = fuente.get_object()["/BaseFont"]
+            if "+" in nombre:
+                subconjuntos.setdefault(nombre, set()).add(fuente.idnum)
+        logos.update(imagen.idnum for imagen in recursos["/XObject"].values())
+    assert len(subconjuntos) == 6
+    assert all(len(objetos) == 1 for objetos in subconjuntos.values())
+    assert len({nombre.split("+")[0] for nombre in subconjuntos}) == 6
+    assert len(logos) == 1
+
+
+def test_ruta_reporte_exige_secreto(tmp_path, monkeypatch):
+    import app as aplicacion
+
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(historial, "DB_PATH", str(tmp_path / "facturas.db"))
+    _registrar_dia(historial.DB_PATH)
+    cliente = aplicacion.app.test_client()
+    url = "/reporte?desde=2024-09-10"
+
+    monkeypatch.setattr(aplicacion, "REPORTE_SECRETO", None)
+    assert cliente.get(url, headers={"X-Reporte": "cierre"}).status_code == 404
+
+    monkeypatch.setattr(aplicacion, "REPORTE_SECRETO", "cierre")
+    assert cliente.get(url).status_code == 404
+    assert cliente.get(url, headers={"X-Reporte": "otra"}).status_code == 404
+    assert cliente.get("/t/principal/reporte?desde=2024-09-10&clave=otra").status_code == 404
+    respuesta = cliente.get(url, headers={"X-Reporte": "cierre"})
+    assert respuesta.status_code == 200
+    assert respuesta.data.startswith(b"%PDF")
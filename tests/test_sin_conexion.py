@@ -0,0 +1,149 @@
+from pathlib import Path
+import json
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import historial
+from generar_factura import LAYOUT, LAYOUT_VERSION, THEMES, layout_spec
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    import app as aplicacion
+    from limites import Limitador
+
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(historial, "DB_PATH", str(tmp_path / "facturas.db"))
+    monkeypatch.setattr(
+        aplicacion, "limitadores_tienda", {slug: Limitador(rafaga=100) for slug in aplicacion.TIENDAS}
+    )
+    return aplicacion.app.test_client()
+
+
+def test_layout_spec_es_json_versionado(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    spec = json.loads(json.dumps(layout_spec()))
+
+    assert spec["version"] == LAYOUT_VERSION
+    assert spec["layout"] == json.loads(json.dumps(LAYOUT))
+    assert set(spec["plantillas"]) == set(THEMES)
+    assert spec["plantillas"]["A"]["colores"]["primary"] == "#003366"
+    assert spec["plantillas"]["B"]["logo"] == "/static/logo_b.png"
+    # Anchos WinAnsi de 32 a 255 en milésimas de em ("A" en Helvetica = 667).
+    anchos = spec["fuentes"]["regular"]["anchos"]
+    assert spec["fuentes"]["regular"]["nombre"] == "Helvetica"
+    assert len(anchos) == 224 and anchos[ord("A") - 32] == 667
+
+
+def test_ruta_layout_con_etag(cliente):
+    respuesta = cliente.get("/layout.json")
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()["version"] == LAYOUT_VERSION
+
+    etag = respuesta.headers["ETag"]
+    assert cliente.get("/layout.json", headers={"If-None-Match": etag}).status_code == 304
+    assert cliente.get("/t/nadie/layout.json").status_code == 404
+
+
+def test_service_worker_desde_la_raiz(cliente):
+    respuesta = cliente.get("/sw.js")
+    assert respuesta.status_code == 200
+    assert "javascript" in respuesta.mimetype
+
+
+def test_pedido_sin_conexion_se_registra_una_vez(cliente):
+    datos = {
+        "id_local": "3f6c2a9e-1b7d-4c55-9a0e-2d4f8b6c1e70",
+        "cliente": "Ana",
+        "estado": "PAGADO",
+        "fecha": "2024-09-10",
+        "productos": "2 pelota gloria a 65",
+        "plantilla": "B",
+    }
+
+    primero = cliente.post("/pedidos", data=datos)
+    reintento = cliente.post("/pedidos", data=datos)
+    # Otra venta con los mismos datos (otro id_local) es otro comprobante.
+    igual = cliente.post("/pedidos", data={**datos, "id_local": "otro-pedido-1234"})
+
+    assert primero.status_code == 200
+    assert reintento.get_json()["numero"] == primero.get_json()["numero"]
+    assert igual.get_json()["numero"] == primero.get_json()["numero"] + 1
+    facturas = list(historial.iterar_facturas("2024-09-10", "2024-09-10"))
+    assert len(facturas) == 2
+    assert facturas[0]["plantilla"] == "B" and facturas[0]["total"] == 130.0
+    assert facturas[1]["total"] == 130.0
+
+
+def test_reemitir_una_venta_actualiza_su_registro(cliente):
+    datos = {
+        "id_local": "pedido-12345",
+        "cliente": "Ana",
+        "estado": "PENDIENTE",
+        "fecha": "2024-09-10",
+        "productos": "2 pelota a 65",
+    }
+
+    assert cliente.post("/generar_desde_texto", data=datos).status_code == 200
+    # La misma venta, ahora con un abono: se actualiza la fila y conserva el número.
+    abono = {**datos, "estado": "PAGO PARCIAL", "monto_parcial": "50"}
+    assert cliente.post("/generar_desde_texto", data=abono).status_code == 200
+    (factura,) = historial.iterar_facturas("2024-09-10", "2024-09-10")
+    assert (factura["numero"], factura["estado"], factura["pago_parcial"]) == (1, "PAGO PARCIAL", 50.0)
+    sincronizado = cliente.post("/pedidos", data={**abono, "estado": "PAGADO", "monto_parcial": ""})
+
+    assert sincronizado.get_json()["numero"] == 1
+    facturas = list(historial.iterar_facturas("2024-09-10", "2024-09-10"))
+    assert [(f["numero"], f["estado"], f["pago_parcial"]) for f in facturas] == [(1, "PAGADO", 0.0)]
+
+    # Sin id_local cada comprobante es una venta distinta, aunque los datos coincidan.
+    sin_id = {campo: valor for campo, valor in datos.items() if campo != "id_local"}
+    assert cliente.post("/generar_desde_texto", data=sin_id).status_code == 200
+    assert cliente.post("/generar_desde_texto", data=sin_id).status_code == 200
+    assert historial.resumen("2024-09-10", "2024-09-10")["cantidad"] == 3
+
+
+def test_pedido_sin_conexion_valida_datos(cliente):
+    datos = {"cliente": "Ana", "estado": "PAGADO", "fecha": "2024-09-10", "productos": "2 pelota gloria a 65"}
+
+    assert cliente.post("/pedidos", data=datos).status_code == 422
+    respuesta = cliente.post("/pedidos", data={**datos, "id_local": "pedido-12345", "productos": "pelota"})
+    assert respuesta.status_code == 422
+
+
+def test_render_fallido_no_queda_en_el_historial(cliente, monkeypatch):
+    import app as aplicacion
+
+    def _fallar(*args, **kwargs):
+        raise RuntimeError("render roto")
+
+    datos = {"cliente": "Ana", "estado": "PAGADO", "fecha": "2024-09-10", "productos": "2 pelota a 65"}
+    generar_artefactos = aplicacion.generar_artefactos
+    monkeypatch.setattr(aplicacion, "generar_artefactos", _fallar)
+    assert cliente.post("/generar_desde_texto", data=datos).status_code == 500
+    assert historial.resumen("2024-09-10", "2024-09-10")["cantidad"] == 0
+
+    monkeypatch.setattr(aplicacion, "generar_artefactos", generar_artefactos)
+    assert cliente.post("/generar_desde_texto", data=datos).status_code == 200
+    # El número no se consumió con el intento fallido.
+    assert [f["numero"] for f in historial.iterar_facturas("2024-09-10", "2024-09-10")] == [1]
+
+
+def test_pedido_encolado_tras_timeout_no_se_registra_dos_veces(cliente):
+    # El servidor terminó el render aunque el navegador ya había abandonado la
+    # petición y generado el comprobante localmente con el mismo id_local.
+    datos = {"cliente": "Ana", "estado": "PAGADO", "fecha": "2024-09-10", "productos": "2 pelota a 65"}
+    id_local = "3f6c2a9e-1b7d-4c55-9a0e-2d4f8b6c1e70"
+
+    assert cliente.post("/generar_desde_texto", data={**datos, "id_local": id_local}).status_code == 200
+    sincronizado = cliente.post("/pedidos", data={**datos, "id_local": id_local, "plantilla": "B"})
+
+    assert sincronizado.get_json()["numero"] == 1
+    assert historial.resumen("2024-09-10", "2024-09-10")["cantidad"] == 1
+    invalido = cliente.post("/generar_desde_texto", data={**datos, "id_local": "no valido!"})
+    assert invalido.status_code == 422
@@ -0,0 +1,158 @@
+from pathlib import Path
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+import historial
+from app import ValidacionError, parsear_productos
+from tiendas import cargar_tiendas, resolver_tienda
+
+CONFIG = {
+    "norte": {
+        "dominios": ["facturas.norte.com"],
+        "plantillas": {"A": {"title": "Norte", "primary": "#112233"}},
+        "catalogo": {"Pelota  Gloria": 65},
+        "max_renders": 1,
+    },
+    "sur": {},
+}
+
+
+@pytest.fixture
+def tiendas(tmp_path):
+    ruta = tmp_path / "tiendas.json"
+    ruta.write_text(json.dumps(CONFIG), encoding="utf-8")
+    return cargar_tiendas(str(ruta))
+
+
+def test_sin_archivo_hay_una_tienda_con_las_plantillas_actuales():
+    tiendas = cargar_tiendas(None)
+    assert list(tiendas) == ["principal"]
+    assert set(tiendas["principal"]["plantillas"]) == {"A", "B"}
+
+
+def test_configuracion_de_tienda(tiendas):
+    norte = tiendas["norte"]
+    assert list(norte["plantillas"]) == ["A"]
+    assert norte["plantillas"]["A"]["title"] == "Norte"
+    assert norte["plantillas"]["A"]["primary"].hexval() == "0x112233"
+    # Lo no configurado se hereda del tema base.
+    assert norte["plantillas"]["A"]["logo"] == "static/logo.png"
+    assert norte["catalogo"] == {"pelota gloria": 65.0}
+    assert set(tiendas["sur"]["plantillas"]) == {"A", "B"}
+
+
+@pytest.mark.parametrize(
+    "host,slug,esperada",
+    [
+        ("localhost:8000", "sur", "sur"),
+        ("facturas.norte.com", None, "norte"),
+        ("sur.ejemplo.com", None, "sur"),
+    ],
+)
+def test_resolver_tienda(tiendas, host, slug, esperada):
+    assert resolver_tienda(tiendas, host, slug)["slug"] == esperada
+
+
+def test_host_desconocido_sin_tienda_principal(tiendas):
+    assert resolver_tienda(tiendas, "otra.ejemplo.com") is None
+    assert resolver_tienda(tiendas, "localhost") is None
+    assert resolver_tienda(cargar_tiendas(None), "otra.ejemplo.com")["slug"] == "principal"
+
+
+def test_slug_desconocido_en_ruta(tiendas):
+    assert resolver_tienda(tiendas, "localhost", "nadie") is None
+
+
+def test_catalogo_completa_precio_faltante(tiendas):
+    catalogo = tiendas["norte"]["catalogo"]
+    assert parsear_productos("3 Pelota gloria", catalogo=catalogo) == [[3, "Pelota gloria", 65.0, 195.0]]
+    with pytest.raises(ValidacionError):
+        parsear_productos("3 pelota gloria")
+
+
+def test_correlativo_por_tienda(tmp_path):
+    db = str(tmp_path / "facturas.db")
+    productos = [[1, "balón", 90.0, 90.0]]
+
+    numeros = [
+        historial.registrar("Ana", "PAGADO", "10/09/2024", productos, tienda=tienda, db_path=db)
+        for tienda in ("norte", "norte", "sur", "norte")
+    ]
+
+    assert numeros == [1, 2, 1, 3]
+    assert historial.resumen("2024-09-10", "2024-09-10", tienda="sur", db_path=db)["cantidad"] == 1
+    assert [f["numero"] for f in historial.iterar_facturas("2024-09-10", "2024-09-10", tienda="norte", db_path=db)] == [1, 2, 3]
+
+
+def test_migracion_de_historial_sin_tiendas(tmp_path):
+    import sqlite3
+
+    db = str(tmp_path / "viejo.db")
+    conn = sqlite3.connect(db)
+    conn.executescript(
+        "CREATE TABLE facturas (id INTEGER PRIMARY KEY AUTOINCREMENT, creada TEXT NOT NULL,"
+        " fecha TEXT NOT NULL, plantilla TEXT NOT NULL, cliente TEXT NOT NULL, estado TEXT NOT NULL,"
+        " total REAL NOT NULL, pago_parcial REAL NOT NULL DEFAULT 0, productos TEXT NOT NULL);"
+        "INSERT INTO facturas (creada, fecha, plantilla, cliente, estado, total, productos)"
+        " VALUES ('2024-09-10T10:00:00', '2024-09-10', 'A', 'Ana', 'PAGADO', 10, '[]');"
+    )
+    conn.commit()
+    conn.close()
+
+    assert historial.registrar("Luis", "PAGADO", "10/09/2024", [[1, "x", 5.0, 5.0]], db_path=db) == 1
+    assert historial.resumen("2024-09-10", "2024-09-10", db_path=db)["cantidad"] == 2
+
+
+def test_ruta_por_tienda_aisla_miniaturas(tiendas, tmp_path, monkeypatch):
+    import app as aplicacion
+    from limites import Limitador
+
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(historial, "DB_PATH", str(tmp_path / "facturas.db"))
+    monkeypatch.setattr(aplicacion, "TIENDAS", tiendas)
+    monkeypatch.setattr(aplicacion, "MINIATURAS_DIR", str(tmp_path / "miniaturas"))
+    monkeypatch.setattr(
+        aplicacion, "limitadores_tienda", {slug: Limitador(espacio=slug) for slug in tiendas}
+    )
+    cliente = aplicacion.app.test_client()
+    datos = {"cliente": "Ana", "estado": "PAGADO", "fecha": "2024-09-10", "productos": "2 pelota gloria"}
+
+    sin_miniatura = cliente.post("/t/norte/generar_desde_texto", data={**datos, "miniatura": "0"})
+    assert "X-Miniatura" not in sin_miniatura.headers
+    respuesta = cliente.post("/t/norte/generar_desde_texto", data=datos)
+
+    assert respuesta.status_code == 200
+    enlace = respuesta.headers["X-Miniatura"]
+    assert enlace.startswith("/t/norte/miniatura/")
+    # En disco: cualquier worker que reciba el GET la encuentra.
+    assert (tmp_path / "miniaturas" / "norte" / (enlace.rsplit("/", 1)[1] + ".png")).is_file()
+    assert cliente.get(enlace).status_code == 200
+    assert cliente.get("/t/norte/miniatura/..").status_code == 404
+    assert cliente.get(enlace.replace("/t/norte/", "/t/sur/")).status_code == 404
+    assert cliente.post("/t/nadie/generar_desde_texto", data=datos).status_code == 404
+
+    metricas = cliente.get("/metricas").get_json()
+    assert "admitidas" not in metricas["limites"]
+    assert metricas["tiendas"]["norte"]["admitidas"] == 2
+
+
+def test_miniaturas_respetan_el_tope_de_la_tienda(tiendas, tmp_path, monkeypatch):
+    import app as aplicacion
+
+    monkeypatch.setattr(aplicacion, "MINIATURAS_DIR", str(tmp_path))
+    tienda = {**tiendas["sur"], "max_miniaturas": 2}
+    claves = [f"{i:064x}" for i in range(3)]
+    for i, clave in enumerate(claves):
+        aplicacion._guardar_miniatura(tienda, clave, b"png")
+        os.utime(tmp_path / "sur" / f"{clave}.png", (i, i))
+
+    assert len(list((tmp_path / "sur").glob("*.png"))) == 2
+    assert aplicacion._obtener_miniatura("sur", claves[0]) is None
+    assert aplicacion._obtener_miniatura("sur", claves[2]) is not None
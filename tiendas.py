@@ -0,0 +1,78 @@
+# tiendas.py
+"""Tiendas (tenants): cada una con sus plantillas, correlativo, catálogo y cuotas."""
+import json
+
+from reportlab.lib import colors
+
+from generar_factura import THEMES
+from historial import TIENDA_PREDETERMINADA
+
+_COLORES_TEMA = ("primary", "accent", "note", "line")
+
+
+def _tema(config, base):
+    """Tema de una tienda: parte de 'base' y convierte los colores '#rrggbb'."""
+    tema = dict(base)
+    for clave, valor in config.items():
+        if clave in _COLORES_TEMA and isinstance(valor, str):
+            valor = colors.HexColor(valor)
+        tema[clave] = valor
+    return tema
+
+
+def _tienda(slug, config):
+    plantillas = {
+        clave.upper(): _tema(tema, THEMES.get(clave.upper(), THEMES["A"]))
+        for clave, tema in (config.get("plantillas") or {}).items()
+    }
+    return {
+        "slug": slug,
+        "plantillas": plantillas or dict(THEMES),
+        "dominios": [d.lower() for d in config.get("dominios", [])],
+        # Precios por descripción para líneas que no indican precio.
+        "catalogo": {
+            " ".join(str(desc).lower().split()): float(precio)
+            for desc, precio in (config.get("catalogo") or {}).items()
+        },
+        # Cuotas; None usa el valor global de la aplicación.
+        "max_renders": config.get("max_renders"),
+        "limite_tasa": config.get("limite_tasa"),
+        "limite_rafaga": config.get("limite_rafaga"),
+        "max_miniaturas": config.get("max_miniaturas"),
+    }
+
+
+def cargar_tiendas(path=None):
+    """
+    Lee la configuración de tiendas desde un JSON {slug: {...}}. Sin archivo,
+    hay una sola tienda con las plantillas de THEMES, como antes.
+    """
+    if not path:
+        return {TIENDA_PREDETERMINADA: _tienda(TIENDA_PREDETERMINADA, {})}
+    with open(path, encoding="utf-8") as f:
+        datos = json.load(f)
+    if not datos:
+        raise ValueError(f"El archivo de tiendas '{path}' no define ninguna tienda.")
+    return {slug: _tienda(slug, config) for slug, config in datos.items()}
+
+
+def resolver_tienda(tiendas, host, slug=None):
+    """
+    Tienda de la petición: por el prefijo de ruta (/t/<slug>/) si lo hay, si no
+    por dominio configurado o subdominio, y por último la tienda 'principal'.
+    Devuelve None si el slug de la ruta no existe o si ningún dato de la petición
+    identifica una tienda: un subdominio mal escrito no debe numerar ni registrar
+    comprobantes en el historial de otra tienda.
+    """
+    if slug is not None:
+        return tiendas.get(slug)
+
+    host = (host or "").split(":")[0].lower()
+    for tienda in tiendas.values():
+        if host in tienda["dominios"]:
+            return tienda
+    if host.count(".") >= 2:
+        subdominio = host.split(".", 1)[0]
+        if subdominio in tiendas:
+            return tiendas[subdominio]
+    return tiendas.get(TIENDA_PREDETERMINADA)